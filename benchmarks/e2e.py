@@ -0,0 +1,203 @@
+import os
+import sys
+import json
+import time
+import runpy
+import shutil
+import socket
+import argparse
+import tempfile
+import statistics
+import subprocess
+from urllib.parse import urlencode
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+KODI_PATH = os.path.join(ROOT_PATH, "benchmarks", "kodi")
+DIALECTS = ("bsplayer", "opensubtitles", "getsubtitle")
+ENGINES = {"bsplayer": "BSPlayer", "opensubtitles": "OpenSubtitles", "getsubtitle": "GetSubtitle"}
+PERCENTILES = (50, 90, 95, 99)
+
+
+def redirect_hosts(hosts):
+    # Every connection to a service host ends up on its local stand-in server
+    create_connection = socket.create_connection
+
+    def redirected_create_connection(address, *args, **kwargs):
+        if address[0] in hosts:
+            address = ("127.0.0.1", hosts[address[0]])
+        return create_connection(address, *args, **kwargs)
+
+    socket.create_connection = redirected_create_connection
+
+
+def run_child(config_path):
+    with open(config_path, "r") as f:
+        config = json.load(f)
+    os.environ["BSPLAYER_HARNESS"] = config_path
+    sys.path[:0] = [KODI_PATH, ROOT_PATH]
+    redirect_hosts(config["hosts"])
+
+    from harness import events
+
+    sys.argv = ["plugin://service.subtitles.bsplayer/", "1", "?" + urlencode(config["params"])]
+    error = None
+    try:
+        runpy.run_path(os.path.join(ROOT_PATH, "service.py"), run_name="__main__")
+    except Exception as ex:
+        error = repr(ex)
+    print(json.dumps(dict(events=events, error=error)))
+
+
+def parse_dialect_option(value, cast=float):
+    # "50" applies to every dialect, "bsplayer=200,50" to the named ones and the rest respectively
+    default, values = cast(0), {}
+    for part in value.split(","):
+        if "=" in part:
+            dialect, part = part.split("=", 1)
+            values[dialect.strip()] = cast(part)
+        else:
+            default = cast(part)
+    return {dialect: values.get(dialect, default) for dialect in DIALECTS}
+
+
+def get_stats(values):
+    if not values:
+        return None
+    values = sorted(values)
+    stats = dict(count=len(values), min=values[0], max=values[-1], mean=statistics.mean(values))
+    for percentile in PERCENTILES:
+        # Linear interpolation between the closest ranks
+        rank = (len(values) - 1) * percentile / 100
+        low = int(rank)
+        high = min(low + 1, len(values) - 1)
+        stats[f"p{percentile}"] = values[low] + (values[high] - values[low]) * (rank - low)
+    return stats
+
+
+def get_download_params(engine, run):
+    if engine == "BSPlayer":
+        link = f"http://s1.api.bsplayer-subtitles.com/download.php?subID={run}"
+    elif engine == "OpenSubtitles":
+        link = f"http://dl.opensubtitles.org/en/download/filead/{run}.gz"
+    else:
+        link = f"http://api.getsubtitle.com/?{urlencode(dict(cod_subtitle_file=run, movie_hash='0' * 16))}"
+    return dict(action="download", engine=engine, link=link, file_name=f"subtitle.{run}.srt", format="srt")
+
+
+def run_once(args, hosts, settings, work_path, profile_path, run):
+    # Imported late, the child process must load the addon modules after the stub modules are on its path
+    from benchmarks import fixtures
+
+    playing_file = os.path.join(work_path, "movie.mkv" if args.same_file else f"movie.{run}.mkv")
+    if not os.path.exists(playing_file):
+        fixtures.create_media_file(playing_file, 700 << 20)
+
+    if args.action == "search":
+        params = dict(action="search", languages=args.languages)
+    else:
+        params = get_download_params(ENGINES[args.engines[run % len(args.engines)]], run)
+
+    config_path = os.path.join(work_path, "config.json")
+    with open(config_path, "w") as f:
+        json.dump(dict(
+            params=params, hosts=hosts, settings=settings, profile=profile_path,
+            playing_file=playing_file, log=args.log
+        ), f)
+
+    start = time.time()
+    child = subprocess.run(
+        [sys.executable, "-m", "benchmarks.e2e", "--child", config_path],
+        cwd=ROOT_PATH, stdout=subprocess.PIPE, universal_newlines=True
+    )
+    finished = time.time()
+    if not args.same_file:
+        os.remove(playing_file)
+
+    result = json.loads(child.stdout.strip().splitlines()[-1]) if child.stdout.strip() else {}
+    events = result.get("events", [])
+    first_result = next((e["time"] for e in events if e["event"] == "items" and e["count"]), None)
+    end = next((e["time"] for e in events if e["event"] == "end"), None)
+    return dict(
+        first_result=first_result - start if first_result else None,
+        dialog=end - start if end else None,
+        total=finished - start,
+        results=sum(e.get("count", 0) for e in events if e["event"] == "items"),
+        error=result.get("error") or (None if child.returncode == 0 else f"exit code {child.returncode}"),
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="BSPlayer subtitles end-to-end latency harness.")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("-n", "--runs", type=int, default=20, help="simulated dialog opens")
+    parser.add_argument("--action", choices=("search", "download"), default="search")
+    parser.add_argument("--engines", default=",".join(DIALECTS), help="engines used by the download action")
+    parser.add_argument("--languages", default="English,Hebrew")
+    parser.add_argument("--items", type=int, default=20, help="subtitles in each search response")
+    parser.add_argument("--latency", default="0.05", help="seconds, for all or per dialect: bsplayer=0.2,...")
+    parser.add_argument("--jitter", default="0.02", help="seconds, for all or per dialect")
+    parser.add_argument("--error-rate", default="0", help="0..1, for all or per dialect")
+    parser.add_argument("--slow-body", default="0", help="seconds a response body trickles in, per dialect")
+    parser.add_argument("--setting", action="append", default=[], help="addon setting override: id=value")
+    parser.add_argument("--cold", action="store_true", help="start every run with an empty profile")
+    parser.add_argument("--same-file", action="store_true", help="play the same file on every run")
+    parser.add_argument("--log", help="append the addon log to this file")
+    parser.add_argument("-o", "--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    if args.child:
+        return run_child(args.child)
+
+    from benchmarks.servers import Faults, start_servers
+
+    args.engines = [engine for engine in args.engines.split(",") if engine]
+    latency, jitter = parse_dialect_option(args.latency), parse_dialect_option(args.jitter)
+    error_rate, slow_body = parse_dialect_option(args.error_rate), parse_dialect_option(args.slow_body)
+    faults = {
+        dialect: Faults(latency[dialect], jitter[dialect], error_rate[dialect], slow_body[dialect])
+        for dialect in DIALECTS
+    }
+    servers, hosts = start_servers(faults, items=args.items)
+    # OpenSubtitles is skipped without credentials
+    settings = dict(OSuser="harness", OSpass="harness")
+    settings.update(setting.split("=", 1) for setting in args.setting)
+
+    work_path = tempfile.mkdtemp(prefix="bsplayer-e2e-")
+    runs = []
+    try:
+        for run in range(args.runs):
+            profile_path = os.path.join(work_path, f"profile.{run}" if args.cold else "profile")
+            runs.append(run_once(args, hosts, settings, work_path, profile_path, run))
+            print(f"run {run + 1}/{args.runs}: {json.dumps(runs[-1])}", file=sys.stderr)
+    finally:
+        shutil.rmtree(work_path, ignore_errors=True)
+        for server in servers.values():
+            server.shutdown()
+
+    report = dict(
+        created=time.time(),
+        action=args.action,
+        config=dict(
+            runs=args.runs, items=args.items, languages=args.languages, cold=args.cold, settings=settings,
+            faults={dialect: vars(fault) for dialect, fault in faults.items()}
+        ),
+        unit="seconds",
+        stats={
+            metric: get_stats([run[metric] for run in runs if run[metric] is not None])
+            for metric in ("first_result", "dialog", "total")
+        },
+        errors=sum(1 for run in runs if run["error"]),
+        empty=sum(1 for run in runs if not run["results"]),
+        servers={dialect: server.counters for dialect, server in servers.items()},
+        runs=runs,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
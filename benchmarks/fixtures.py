@@ -0,0 +1,173 @@
+import os
+import zlib
+import base64
+import struct
+from xmlrpc import client
+from xml.sax.saxutils import escape
+
+from resources.lib.utils import HASH_CHUNK_SIZE, RAR5_SIGNATURE
+
+LANGUAGES = ("eng", "heb", "spa", "fre", "ger")
+RELEASES = ("1080p.BluRay.x264-SPARKS", "720p.WEB-DL.DD5.1.H264-FGT", "HDTV.x264-LOL", "BRRip.XviD-AQOS")
+
+SOAP_RESPONSE = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" '
+    'xmlns:SOAP-ENC="http://schemas.xmlsoap.org/soap/encoding/" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xsd="http://www.w3.org/2001/XMLSchema" '
+    'xmlns:ns1="{namespace}">'
+    '<SOAP-ENV:Body><ns1:{func_name}Response>{body}</ns1:{func_name}Response></SOAP-ENV:Body>'
+    '</SOAP-ENV:Envelope>'
+)
+
+
+def soap_response(func_name, body, namespace="http://api.bsplayer-subtitles.com/v1.php"):
+    return SOAP_RESPONSE.format(func_name=func_name, body=body, namespace=namespace).encode()
+
+
+def soap_item(**fields):
+    return "<item>" + "".join(
+        f'<{name} xsi:type="xsd:string">{escape(str(value))}</{name}>' for name, value in fields.items()
+    ) + "</item>"
+
+
+def get_subtitle_name(i):
+    return f"Movie.Title.{2000 + i % 20}.{RELEASES[i % len(RELEASES)]}.{LANGUAGES[i % len(LANGUAGES)]}.srt"
+
+
+def bsplayer_login_response(token="bench-token"):
+    return soap_response("logIn", f"<return><result><result>200</result><status>OK</status>"
+                                  f"<data>{token}</data></result></return>")
+
+
+def bsplayer_logout_response():
+    return soap_response("logOut", "<return><result><result>200</result><status>OK</status></result></return>")
+
+
+def bsplayer_status_response(func_name, status):
+    return soap_response(func_name, f"<return><result><result>401</result><status>{status}</status>"
+                                    f"<data></data></result></return>")
+
+
+def bsplayer_search_response(count, download_url="http://s1.api.bsplayer-subtitles.com/download.php"):
+    items = "".join(soap_item(
+        subID=100000 + i,
+        subSize=40000 + i,
+        subDownloadLink=f"{download_url}?subID={100000 + i}",
+        subLang=LANGUAGES[i % len(LANGUAGES)],
+        subName=get_subtitle_name(i),
+        subFormat="srt",
+        subHits=1000 - i % 1000,
+        subRating=f"{i % 11}",
+        season=0,
+        episode=0,
+        encodedWith="",
+        movieIMBDID="tt0000001",
+        movieFPS="23.976",
+        movieHash="0123456789abcdef",
+    ) for i in range(count))
+    return soap_response("searchSubtitles", (
+        f'<return><result><result>200</result><status>OK</status><data></data></result>'
+        f'<data SOAP-ENC:arrayType="tns:SubtitleInfo[{count}]">{items}</data></return>'
+    ))
+
+
+def opensubtitles_login_response(token="bench-token"):
+    return client.dumps(({"status": "200 OK", "token": token, "seconds": 0.01},), methodresponse=True).encode()
+
+
+def opensubtitles_logout_response():
+    return client.dumps(({"status": "200 OK", "seconds": 0.01},), methodresponse=True).encode()
+
+
+def opensubtitles_search_response(count, download_url="http://dl.opensubtitles.org/en/download/filead"):
+    data = [{
+        "IDSubtitle": str(200000 + i),
+        "IDSubtitleFile": str(300000 + i),
+        "SubFileName": get_subtitle_name(i),
+        "SubFormat": "srt",
+        "SubLanguageID": LANGUAGES[i % len(LANGUAGES)],
+        "SubRating": f"{i % 11}.0",
+        "SubDownloadsCnt": str(1000 - i % 1000),
+        "SubDownloadLink": f"{download_url}/{300000 + i}.gz",
+        "MovieName": "Movie Title",
+        "MovieYear": str(2000 + i % 20),
+        "MovieHash": "0123456789abcdef",
+        "IDMovieImdb": "1",
+        "ISO639": LANGUAGES[i % len(LANGUAGES)][:2],
+    } for i in range(count)]
+    return client.dumps(({"status": "200 OK", "data": data or False, "seconds": 0.1},),
+                        methodresponse=True).encode()
+
+
+def getsubtitle_search_response(count):
+    items = "".join(soap_item(
+        cod_subtitle_file=400000 + i,
+        movie_hash="0123456789abcdef",
+        file_name=get_subtitle_name(i),
+        desc_reduzido=LANGUAGES[i % len(LANGUAGES)],
+        downloads=1000 - i % 1000,
+    ) for i in range(count))
+    return soap_response("searchSubtitlesByHash", f"<return>{items}</return>",
+                         namespace="searchSubtitlesByHash_wsdl")
+
+
+def getsubtitle_download_response(cod_subtitle_files, data=b"1\n00:00:01,000 --> 00:00:02,000\nHello\n"):
+    encoded = base64.b64encode(zlib.compress(data)).decode()
+    items = "".join(soap_item(cod_subtitle_file=cod, data=encoded) for cod in cod_subtitle_files)
+    return soap_response("downloadSubtitles", f"<return>{items}</return>", namespace="downloadSubtitles_wsdl")
+
+
+def create_media_file(file_path, size):
+    # Sparse file with random bytes in the two windows that are hashed
+    with open(file_path, "wb") as f:
+        f.write(os.urandom(HASH_CHUNK_SIZE))
+        f.seek(size - HASH_CHUNK_SIZE)
+        f.write(os.urandom(HASH_CHUNK_SIZE))
+    return file_path
+
+
+def vint(value):
+    data = b""
+    while True:
+        byte, value = value & 0x7F, value >> 7
+        if not value:
+            return data + bytes([byte])
+        data += bytes([byte | 0x80])
+
+
+def rar4_volume_header(packed_size, unpack_size, file_name=b"movie.mkv"):
+    main = struct.pack("<HBHH", 0, 0x73, 0x0001, 13) + b"\0" * 6
+    flags = 0x8000 | (0x0100 if unpack_size >> 32 else 0)
+    head = struct.pack(
+        "<BHHIIBIIBBHI", 0x74, flags, 32 + (8 if flags & 0x0100 else 0) + len(file_name),
+        packed_size, unpack_size & 0xFFFFFFFF, 2, 0, 0, 29, 0x30, len(file_name), 0
+    )
+    if flags & 0x0100:
+        head += struct.pack("<II", packed_size >> 32, unpack_size >> 32)
+    return b"Rar!\x1a\x07\x00" + main + b"\0\0" + head + file_name
+
+
+def rar5_volume_header(packed_size, unpack_size, file_name=b"movie.mkv"):
+    main_fields = vint(1) + vint(0) + vint(0x0001)
+    file_fields = (
+        vint(2) + vint(0x0002) + vint(packed_size) + vint(0x0002 | 0x0004) + vint(unpack_size) + vint(0) +
+        b"\0" * 8 + vint(0) + vint(0) + vint(len(file_name)) + file_name
+    )
+    return (
+        RAR5_SIGNATURE + b"\0\0\0\0" + vint(len(main_fields)) + main_fields +
+        b"\0\0\0\0" + vint(len(file_fields)) + file_fields
+    )
+
+
+def create_rar_release(directory, name, unpack_size, volume_size, rar5=False):
+    volumes = (unpack_size + volume_size - 1) // volume_size
+    volume_header = rar5_volume_header if rar5 else rar4_volume_header
+    for i in range(volumes):
+        packed_size = min(volume_size, unpack_size - i * volume_size)
+        volume_name = f"{name}.part{i + 1:0{len(str(volumes))}d}.rar"
+        with open(os.path.join(directory, volume_name), "wb") as f:
+            f.write(volume_header(volume_size, unpack_size))
+            f.write(os.urandom(HASH_CHUNK_SIZE))
+            f.truncate(f.tell() - HASH_CHUNK_SIZE + packed_size)
+    return os.path.join(directory, f"{name}.part{1:0{len(str(volumes))}d}.rar")
@@ -0,0 +1,10 @@
+import os
+import json
+
+# State shared by the stub modules, the harness passes its configuration through BSPLAYER_HARNESS
+config = {}
+if os.environ.get("BSPLAYER_HARNESS"):
+    with open(os.environ["BSPLAYER_HARNESS"], "r") as f:
+        config = json.load(f)
+
+events = []
@@ -0,0 +1,75 @@
+import json
+import time
+
+from harness import config, events
+
+LOGDEBUG = 0
+LOGINFO = 1
+LOGWARNING = 2
+LOGERROR = 3
+ISO_639_1 = 0
+ISO_639_2 = 1
+ENGLISH_NAME = 2
+
+LANGUAGES = [
+    ("English", "en", "eng"), ("Hebrew", "he", "heb"), ("Spanish", "es", "spa"), ("French", "fr", "fre"),
+    ("German", "de", "ger"), ("Portuguese", "pt", "por"), ("Greek", "el", "ell"), ("Arabic", "ar", "ara"),
+]
+
+log_file = open(config["log"], "a") if config.get("log") else None
+
+
+def log(msg, level=LOGDEBUG):
+    if log_file:
+        log_file.write(f"{time.time():.6f} {msg}\n")
+        log_file.flush()
+
+
+def executebuiltin(function, wait=False):
+    log(f"executebuiltin: {function}")
+
+
+def convertLanguage(language, format):
+    for english_name, iso_639_1, iso_639_2 in LANGUAGES:
+        if language in (english_name, iso_639_1, iso_639_2):
+            return {ISO_639_1: iso_639_1, ISO_639_2: iso_639_2, ENGLISH_NAME: english_name}[format]
+    return ""
+
+
+def executeJSONRPC(request):
+    request = json.loads(request)
+    if request["method"] == "Settings.GetSettingValue" and request["params"]["setting"] == "subtitles.languages":
+        return json.dumps(dict(jsonrpc="2.0", id=request["id"], result=dict(value=config.get("languages", ["English"]))))
+    return json.dumps(dict(jsonrpc="2.0", id=request["id"], error=dict(code=-32601, message="Method not found.")))
+
+
+def getCondVisibility(condition):
+    return False
+
+
+def sleep(time_ms):
+    time.sleep(time_ms / 1000)
+
+
+class Player(object):
+    def getPlayingFile(self):
+        return config.get("playing_file", "")
+
+    def isPlayingVideo(self):
+        return bool(config.get("playing_file"))
+
+    def getAvailableSubtitleStreams(self):
+        return config.get("subtitle_streams", [])
+
+    def setSubtitles(self, subtitleFile):
+        events.append(dict(event="subtitles", time=time.time(), path=subtitleFile))
+
+
+class Monitor(object):
+    def abortRequested(self):
+        return False
+
+    def waitForAbort(self, timeout=None):
+        if timeout:
+            time.sleep(timeout)
+        return False
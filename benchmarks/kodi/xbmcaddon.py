@@ -0,0 +1,57 @@
+import os
+from xml.etree import ElementTree
+
+from harness import config
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def load_settings():
+    # Defaults come from the addon's own settings.xml, the harness overrides some of them
+    settings = {
+        setting.get("id"): setting.get("default", "")
+        for setting in ElementTree.parse(os.path.join(ROOT_PATH, "resources", "settings.xml")).iter("setting")
+        if setting.get("id")
+    }
+    settings.update({key: str(value).lower() if isinstance(value, bool) else str(value)
+                     for key, value in config.get("settings", {}).items()})
+    return settings
+
+
+class Addon(object):
+    settings = None
+
+    def __init__(self, id="service.subtitles.bsplayer"):
+        if Addon.settings is None:
+            Addon.settings = load_settings()
+
+    def getAddonInfo(self, id):
+        return {
+            "id": "service.subtitles.bsplayer",
+            "name": "BSPlayer",
+            "version": "0.0.0",
+            "author": "harness",
+            "path": ROOT_PATH,
+            "profile": config.get("profile", os.path.join(ROOT_PATH, ".profile")),
+        }.get(id, "")
+
+    def getLocalizedString(self, id):
+        return f"#{id}"
+
+    def getSetting(self, id):
+        return self.settings.get(id, "")
+
+    def getSettingBool(self, id):
+        return self.getSetting(id).lower() == "true"
+
+    def getSettingInt(self, id):
+        return int(float(self.getSetting(id) or 0))
+
+    def getSettingNumber(self, id):
+        return float(self.getSetting(id) or 0)
+
+    def getSettingString(self, id):
+        return self.getSetting(id)
+
+    def setSetting(self, id, value):
+        self.settings[id] = value
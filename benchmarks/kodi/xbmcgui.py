@@ -0,0 +1,33 @@
+properties = {}
+
+
+class ListItem(object):
+    def __init__(self, label="", label2="", path="", offscreen=False):
+        self.label = label
+        self.label2 = label2
+        self.path = path
+        self.art = {}
+        self.properties = {}
+
+    def setArt(self, values):
+        self.art.update(values)
+
+    def setProperty(self, key, value):
+        self.properties[key] = value
+
+    def getProperty(self, key):
+        return self.properties.get(key, "")
+
+
+class Window(object):
+    def __init__(self, existingWindowId=-1):
+        self.window_id = existingWindowId
+
+    def getProperty(self, key):
+        return properties.get((self.window_id, key), "")
+
+    def setProperty(self, key, value):
+        properties[(self.window_id, key)] = value
+
+    def clearProperty(self, key):
+        properties.pop((self.window_id, key), None)
@@ -0,0 +1,17 @@
+import time
+
+from harness import events
+
+
+def addDirectoryItem(handle, url, listitem, isFolder=False, totalItems=0):
+    events.append(dict(event="items", time=time.time(), count=1))
+    return True
+
+
+def addDirectoryItems(handle, items, totalItems=0):
+    events.append(dict(event="items", time=time.time(), count=len(items)))
+    return True
+
+
+def endOfDirectory(handle, succeeded=True, updateListing=False, cacheToDisc=True):
+    events.append(dict(event="end", time=time.time()))
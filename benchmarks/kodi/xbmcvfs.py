@@ -0,0 +1,56 @@
+import os
+
+
+def translatePath(path):
+    return path
+
+
+def exists(path):
+    return os.path.exists(path)
+
+
+def mkdirs(path):
+    os.makedirs(path, exist_ok=True)
+    return True
+
+
+def delete(path):
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
+
+
+class File(object):
+    def __init__(self, filepath, mode=None):
+        self.f = open(filepath, "wb" if mode and "w" in mode else "rb")
+
+    def read(self, numBytes=-1):
+        return self.f.read(numBytes).decode("utf-8", "replace")
+
+    def readBytes(self, numBytes=-1):
+        return bytearray(self.f.read(numBytes))
+
+    def write(self, buffer):
+        return bool(self.f.write(buffer.encode() if isinstance(buffer, str) else buffer))
+
+    def seek(self, seekBytes, iWhence=0):
+        return self.f.seek(seekBytes, iWhence)
+
+    def size(self):
+        return os.fstat(self.f.fileno()).st_size
+
+    def close(self):
+        self.f.close()
+
+
+class Stat(object):
+    def __init__(self, path):
+        self.stat = os.stat(path)
+
+    def st_size(self):
+        return self.stat.st_size
+
+    def st_mtime(self):
+        return int(self.stat.st_mtime)
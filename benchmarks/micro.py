@@ -0,0 +1,209 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+from email.message import Message
+from urllib.response import addinfourl
+
+# Everything is kept out of the user profile, must be set before the addon modules are imported
+PROFILE_PATH = tempfile.mkdtemp(prefix="bsplayer-bench-")
+os.environ["BSPLAYER_PROFILE"] = PROFILE_PATH
+
+from benchmarks import fixtures
+from resources.lib import utils
+from resources.lib.bsplayer import BSPlayer, OpenSubtitles, GetSubtitle
+from resources.lib.codec import (
+    parse_soap, parse_xmlrpc, soap_params, soap_envelope, getsubtitle_envelope, getsubtitle_download_params,
+    xmlrpc_params, xmlrpc_envelope, opensubtitles_search_params
+)
+
+MEDIA_SIZES = {"1MiB": 1 << 20, "700MiB": 700 << 20, "4GiB": 4 << 30, "50GiB": 50 << 30}
+RAR_RELEASES = {"700MiB": (700 << 20, 50 << 20), "15GiB": (15 << 30, 200 << 20)}
+ITEM_COUNTS = (10, 100, 1000)
+MOVIE_HASH = "0123456789abcdef"
+MOVIE_SIZE = 4 << 30
+
+
+class FixtureSession(object):
+    def __init__(self, responses):
+        self.responses = responses
+
+    def open(self, req, timeout=None):
+        func_name = req.get_header("Soapaction", "").strip('"').split("#")[-1]
+        if not func_name:
+            func_name = req.data.split(b"<methodName>")[1].split(b"</methodName>")[0].decode()
+        body = self.responses[func_name]
+        headers = Message()
+        headers["Content-Length"] = str(len(body))
+        return addinfourl(io.BytesIO(body), headers, req.full_url, 200)
+
+
+def measure(func, min_time=0.2, repeat=5):
+    # Calibrate the loop count so that a single sample runs for about min_time / repeat
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for i in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / repeat or number >= 1 << 20:
+            break
+        number *= 10 if elapsed < min_time / repeat / 10 else 2
+
+    samples = [elapsed / number]
+    for r in range(repeat - 1):
+        start = time.perf_counter()
+        for i in range(number):
+            func()
+        samples.append((time.perf_counter() - start) / number)
+    return dict(
+        number=number, repeat=repeat, min=min(samples), median=statistics.median(samples),
+        mean=statistics.mean(samples), stdev=statistics.stdev(samples) if len(samples) > 1 else 0.0
+    )
+
+
+def get_hash_benchmarks(media_path, name_filter=""):
+    # Every fixture is created right before the benchmarks that use it and removed right after them,
+    # the large sparse files never have to exist side by side and filtered out ones are never created
+    for name, size in MEDIA_SIZES.items():
+        if name_filter not in "hash.file":
+            continue
+        file_path = fixtures.create_media_file(os.path.join(media_path, f"movie.{name}.mkv"), size)
+        try:
+            yield "hash.file", dict(size=name), lambda file_path=file_path: utils.movie_size_and_hash(file_path)
+        finally:
+            os.remove(file_path)
+
+    for name, (unpack_size, volume_size) in RAR_RELEASES.items():
+        for rar_format in ("rar4", "rar5"):
+            if not any(name_filter in benchmark for benchmark in ("hash.rar.index", "hash.rar", "hash.rar.indexed")):
+                continue
+            release_path = os.path.join(media_path, f"{rar_format}.{name}")
+            os.makedirs(release_path)
+            try:
+                first_volume = fixtures.create_rar_release(
+                    release_path, "movie", unpack_size, volume_size, rar5=rar_format == "rar5"
+                )
+                params = dict(size=name, format=rar_format)
+                yield "hash.rar.index", params, lambda first_volume=first_volume: utils.read_rar_index(first_volume)
+                yield "hash.rar", params, lambda first_volume=first_volume: utils.movie_size_and_hash(first_volume)
+                if name_filter in "hash.rar.indexed":
+                    rar_index = utils.read_rar_index(first_volume)
+                    yield "hash.rar.indexed", params, lambda first_volume=first_volume, rar_index=rar_index: (
+                        utils.movie_size_and_hash(first_volume, rar_index=rar_index)
+                    )
+            finally:
+                shutil.rmtree(release_path, ignore_errors=True)
+
+
+def get_codec_benchmarks():
+    search_url = "http://s1.api.bsplayer-subtitles.com/v1.php"
+    yield "envelope.bsplayer.searchSubtitles", {}, lambda: soap_envelope("searchSubtitles", soap_params(
+        ("handle", "bench-token"), ("movieHash", MOVIE_HASH), ("movieSize", MOVIE_SIZE),
+        ("languageId", "eng,heb"), ("imdbId", "*")
+    ), search_url)
+    yield "envelope.opensubtitles.SearchSubtitles", {}, lambda: xmlrpc_envelope(
+        "SearchSubtitles", opensubtitles_search_params("bench-token", MOVIE_SIZE, MOVIE_HASH, "eng,heb")
+    )
+    yield "envelope.opensubtitles.LogIn", {}, lambda: xmlrpc_envelope(
+        "LogIn", xmlrpc_params("user", "password", "en", "BSPlayer v2.78")
+    )
+    for count in ITEM_COUNTS:
+        downloads = [(MOVIE_HASH, str(400000 + i)) for i in range(count)]
+        yield "envelope.getsubtitle.downloadSubtitles", dict(items=count), lambda downloads=downloads: (
+            getsubtitle_envelope("downloadSubtitles", getsubtitle_download_params(downloads))
+        )
+
+    for count in ITEM_COUNTS:
+        params = dict(items=count)
+        response = fixtures.bsplayer_search_response(count)
+        yield "parse.bsplayer.searchSubtitles", params, lambda response=response: (
+            parse_soap(io.BytesIO(response), record_factory=BSPlayer.get_subtitle)
+        )
+        response = fixtures.opensubtitles_search_response(count)
+        yield "parse.opensubtitles.SearchSubtitles", params, lambda response=response: (
+            parse_xmlrpc(io.BytesIO(response))
+        )
+        response = fixtures.getsubtitle_search_response(count)
+        yield "parse.getsubtitle.searchSubtitlesByHash", params, lambda response=response: (
+            parse_soap(io.BytesIO(response))
+        )
+        response = fixtures.getsubtitle_download_response(range(400000, 400000 + count))
+        yield "parse.getsubtitle.downloadSubtitles", params, lambda response=response: (
+            parse_soap(io.BytesIO(response))
+        )
+
+
+def get_engine_benchmarks():
+    # Request building, parsing and record creation through the engines, the network is replaced by fixtures
+    for count in ITEM_COUNTS:
+        params = dict(items=count)
+        engine = BSPlayer(search_url="http://s1.api.bsplayer-subtitles.com/v1.php")
+        engine.session = FixtureSession(dict(searchSubtitles=fixtures.bsplayer_search_response(count)))
+        engine.token = "bench-token"
+        yield "engine.bsplayer.search", params, lambda engine=engine: (
+            engine.search_subtitles_by_hash(MOVIE_SIZE, MOVIE_HASH, "eng,heb")
+        )
+
+        engine = OpenSubtitles("user", "password")
+        engine.session = FixtureSession(dict(SearchSubtitles=fixtures.opensubtitles_search_response(count)))
+        engine.token = "bench-token"
+        yield "engine.opensubtitles.search", params, lambda engine=engine: (
+            engine.search_subtitles_by_hash(MOVIE_SIZE, MOVIE_HASH, "eng,heb")
+        )
+
+        engine = GetSubtitle()
+        engine.session = FixtureSession(dict(searchSubtitlesByHash=fixtures.getsubtitle_search_response(count)))
+        yield "engine.getsubtitle.search", params, lambda engine=engine: (
+            engine.search_subtitles_by_hash(MOVIE_SIZE, MOVIE_HASH, "eng,heb")
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="BSPlayer subtitles microbenchmarks.")
+    parser.add_argument("-o", "--output", help="write the JSON report to this file instead of stdout")
+    parser.add_argument("-k", "--filter", default="", help="only run benchmarks whose name contains this text")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds spent on each benchmark")
+    parser.add_argument("--repeat", type=int, default=5, help="samples taken for each benchmark")
+    args = parser.parse_args(argv)
+
+    media_path = tempfile.mkdtemp(prefix="bsplayer-bench-media-")
+    results = []
+    try:
+        benchmarks = [get_hash_benchmarks(media_path, args.filter), get_codec_benchmarks(), get_engine_benchmarks()]
+        for group in benchmarks:
+            for name, params, func in group:
+                if args.filter not in name:
+                    continue
+                result = dict(name=name, params=params, **measure(func, args.min_time, args.repeat))
+                results.append(result)
+                print(f"{name:45} {json.dumps(params):35} {result['median'] * 1e6:12.1f} us", file=sys.stderr)
+    finally:
+        shutil.rmtree(media_path, ignore_errors=True)
+        shutil.rmtree(PROFILE_PATH, ignore_errors=True)
+
+    report = dict(
+        created=time.time(),
+        python=platform.python_version(),
+        implementation=platform.python_implementation(),
+        platform=platform.platform(),
+        numpy=bool(utils.get_numpy()),
+        unit="seconds",
+        results=results,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import re
+import gzip
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks import fixtures
+from resources.lib.bsplayer import BSPlayer, OpenSubtitles, GetSubtitle
+
+SUBTITLE = b"1\n00:00:01,000 --> 00:00:02,000\nHello\n\n2\n00:00:03,000 --> 00:00:04,000\nWorld\n"
+SLOW_BODY_CHUNKS = 8
+
+
+class Faults(object):
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, slow_body=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.slow_body = slow_body
+
+    def delay(self):
+        time.sleep(max(0.0, random.uniform(self.latency - self.jitter, self.latency + self.jitter)))
+
+    def fail(self):
+        return random.random() < self.error_rate
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    download_host = ""
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type="text/xml; charset=utf-8"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        faults = self.server.faults
+        if not faults.slow_body:
+            self.wfile.write(body)
+            return
+        # The body trickles in over slow_body seconds
+        chunk_size = len(body) // SLOW_BODY_CHUNKS + 1
+        for i in range(0, len(body), chunk_size):
+            self.wfile.write(body[i:i + chunk_size])
+            self.wfile.flush()
+            time.sleep(faults.slow_body / SLOW_BODY_CHUNKS)
+
+    def handle_fault(self):
+        self.server.count("requests")
+        self.server.faults.delay()
+        if self.server.faults.fail():
+            self.server.count("errors")
+            self.send_body(500, b"Internal Server Error", content_type="text/plain")
+            return True
+        return False
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.handle_fault():
+            return
+        response = self.handle_call(self.get_func_name(body), body)
+        if response is None:
+            self.send_body(404, b"Not Found", content_type="text/plain")
+            return
+        self.send_body(200, response)
+
+    def do_GET(self):
+        if self.handle_fault():
+            return
+        self.send_body(200, gzip.compress(SUBTITLE), content_type="application/octet-stream")
+
+    def get_func_name(self, body):
+        return self.headers.get("SOAPAction", "").strip('"').split("#")[-1]
+
+    def handle_call(self, func_name, body):
+        raise NotImplementedError
+
+
+class BSPlayerHandler(StandInHandler):
+    def handle_call(self, func_name, body):
+        # Like the real mirrors, a handle is only valid on the mirror that issued it
+        token = f"bench-token-{self.headers.get('Host', '').split(':')[0]}"
+        if func_name == "logIn":
+            return fixtures.bsplayer_login_response(token)
+        if func_name == "logOut":
+            return fixtures.bsplayer_logout_response()
+        if func_name == "searchSubtitles":
+            if f"<handle>{token}</handle>".encode() not in body:
+                return fixtures.bsplayer_status_response(func_name, "HANDLE_INVALID")
+            return fixtures.bsplayer_search_response(
+                self.server.items, download_url=f"http://{self.download_host}/download.php"
+            )
+        return None
+
+
+class OpenSubtitlesHandler(StandInHandler):
+    def get_func_name(self, body):
+        match = re.search(rb"<methodName>(.*?)</methodName>", body)
+        return match.group(1).decode() if match else ""
+
+    def handle_call(self, func_name, body):
+        if func_name == "LogIn":
+            return fixtures.opensubtitles_login_response()
+        if func_name == "LogOut":
+            return fixtures.opensubtitles_logout_response()
+        if func_name == "SearchSubtitles":
+            return fixtures.opensubtitles_search_response(
+                self.server.items, download_url=f"http://{self.download_host}/en/download/filead"
+            )
+        return None
+
+
+class GetSubtitleHandler(StandInHandler):
+    def handle_call(self, func_name, body):
+        if func_name == "searchSubtitlesByHash":
+            return fixtures.getsubtitle_search_response(self.server.items)
+        if func_name == "downloadSubtitles":
+            cod_subtitle_files = [cod.decode() for cod in re.findall(rb"<cod_subtitle_file>(.*?)<", body)]
+            return fixtures.getsubtitle_download_response(cod_subtitle_files, data=SUBTITLE)
+        return None
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler_class, faults=None, items=20):
+        super().__init__(("127.0.0.1", 0), handler_class)
+        self.faults = faults or Faults()
+        self.items = items
+        self.counters = {}
+        self.counters_lock = threading.Lock()
+
+    def count(self, name):
+        with self.counters_lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+DIALECTS = {
+    "bsplayer": (BSPlayerHandler, "s1.api.bsplayer-subtitles.com"),
+    "opensubtitles": (OpenSubtitlesHandler, "dl.opensubtitles.org"),
+    "getsubtitle": (GetSubtitleHandler, "api.getsubtitle.com"),
+}
+
+
+def get_dialect_hosts(dialect):
+    if dialect == "bsplayer":
+        return [f"{sub_domain}.{BSPlayer.DOMAIN}" for sub_domain in BSPlayer.SUB_DOMAINS]
+    if dialect == "opensubtitles":
+        return [OpenSubtitles.DOMAIN, "dl.opensubtitles.org"]
+    return [GetSubtitle.DOMAIN]
+
+
+def start_servers(faults, items=20):
+    servers = {}
+    hosts = {}
+    for dialect, (handler_class, download_host) in DIALECTS.items():
+        handler = type(handler_class.__name__, (handler_class,), dict(download_host=download_host))
+        servers[dialect] = StandInServer(handler, faults=faults.get(dialect), items=items).start()
+        for host in get_dialect_hosts(dialect):
+            hosts[host] = servers[dialect].server_port
+    return servers, hosts
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+
+from resources.lib.prewarm import Prewarmer, SettingsMonitor
+from resources.lib.utils import log
+
+# Searches start when playback does, the subtitles dialog then answers from the results published by this service
+# Settings changed while it runs are applied from the next playback on
+monitor = SettingsMonitor()
+player = Prewarmer()
+log("Prewarm.service", "Started.")
+monitor.waitForAbort()
+log("Prewarm.service", "Stopped.")
@@ -1,23 +1,46 @@
-﻿import re
-import gzip
-import zlib
-import json
-import socket
-import random
-from time import sleep
-from base64 import b64decode
-from xml.etree import ElementTree
+﻿import json
+import threading
+from time import time
+from concurrent import futures
 from urllib.request import Request
 from abc import ABC, abstractmethod
 from urllib.parse import urlencode, urlparse, parse_qsl
 
-from .utils import movie_size_and_hash, get_session, log
+from .network import get_session
+from .utils import get_setting, iter_gzip, iter_base64_zlib, write_atomic, log
+from .codec import (
+    Subtitle, parse_soap, parse_xmlrpc, soap_params, soap_envelope, getsubtitle_envelope,
+    getsubtitle_download_params, xmlrpc_params, xmlrpc_envelope, opensubtitles_search_params
+)
+from .mirrors import get_mirror_scheduler, get_hedge_policy
+from .retry import get_retry_policy, get_circuit_breaker, RetriesExhausted
+from .metrics import get_metrics
+from .cache import movie_size_and_hash, get_result_cache, get_token_cache
+
+
+# Download hosts that misbehave with pooled HTTP/1.1 connections
+HTTP10_HOSTS = set()
+# Tracing phase of each API function
+API_PHASES = {
+    "logIn": "login", "LogIn": "login",
+    "logOut": "logout", "LogOut": "logout",
+    "searchSubtitles": "search", "SearchSubtitles": "search", "searchSubtitlesByHash": "search",
+}
+
+
+class TokenRejected(Exception):
+    pass
+
+
+def get_max_subtitle_size():
+    return get_setting("max_subtitle_size", 5) * 1024 * 1024
 
 
 class BSPlayerSubtitleEngine(ABC):
     def __init__(self, search_url, proxies=None, username="", password="",
-                 app_id="BSPlayer v2.7", user_agent="BSPlayer/2.x (1106.12378)"):
+                 app_id="BSPlayer v2.7", user_agent="BSPlayer/2.x (1106.12378)", deadline=None):
         self.proxies = proxies
+        self.deadline = deadline
         self.username = username
         self.password = password
         self.app_id = app_id
@@ -25,12 +48,52 @@ class BSPlayerSubtitleEngine(ABC):
         self.session = get_session(proxies=self.proxies)
         self.search_url = search_url
         self.token = None
+        self.closed = False
+        self.refreshing = False
+        self.refresh_lock = threading.Lock()
+
+        saved_session = self.get_saved_session(username, app_id)
+        if saved_session and saved_session["search_url"] == search_url:
+            self.token = saved_session["token"]
 
     def __enter__(self):
         self.login()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        with self.refresh_lock:
+            self.closed = True
+            # The background refresh closes the session once it is done
+            if self.refreshing:
+                return None
+        return self.close()
+
+    @classmethod
+    def get_session_key(cls, username, app_id):
+        return f"{cls.__name__}|{username}|{app_id}"
+
+    @classmethod
+    def get_saved_session(cls, username, app_id):
+        token_cache = get_token_cache()
+        if token_cache is None:
+            return None
+        return token_cache.get_token(cls.get_session_key(username, app_id))
+
+    def save_session(self):
+        token_cache = get_token_cache()
+        if token_cache is None:
+            return
+        key = self.get_session_key(self.username, self.app_id)
+        if self.token:
+            token_cache.store_token(key, self.token, self.search_url)
+        else:
+            token_cache.drop_token(key)
+
+    def close(self):
+        # Keep the token alive for the next invocation instead of logging out
+        if get_token_cache() is not None:
+            self.save_session()
+            return True
         return self.logout()
 
     @abstractmethod
@@ -42,25 +105,161 @@ class BSPlayerSubtitleEngine(ABC):
         pass
 
     @abstractmethod
-    def search_subtitles(self, movie_path, language_ids="heb,eng", logout=False):
+    def search_subtitles_by_hash(self, movie_size, movie_hash, language_ids="heb,eng"):
         pass
 
+    def search_subtitles(self, movie_path, language_ids="heb,eng", logout=False, latencies=None):
+        engine_name = self.__class__.__name__
+        if isinstance(language_ids, (tuple, list, set)):
+            language_ids = ",".join(language_ids)
+
+        try:
+            with get_metrics().span("hash", engine=engine_name):
+                movie_size, movie_hash = movie_size_and_hash(movie_path)
+        except Exception as ex:
+            log(f"{engine_name}.search_subtitles", f"Error Calculating Movie Size / Hash: {ex}.")
+            return []
+
+        log(f"{engine_name}.search_subtitles", f"Movie Size: {movie_size}, Movie Hash: {movie_hash}.")
+        subtitles = self.search_subtitles_cached(movie_size, movie_hash, language_ids, latencies=latencies)
+
+        if logout:
+            self.logout()
+            self.save_session()
+
+        return subtitles
+
+    def search_subtitles_with_token(self, movie_size, movie_hash, language_ids="heb,eng"):
+        try:
+            return self.search_subtitles_by_hash(movie_size, movie_hash, language_ids)
+        except TokenRejected as ex:
+            log(f"{self.__class__.__name__}.search_subtitles", f"Token Rejected ({ex}), Logging In Again.")
+            self.token = None
+            self.save_session()
+            return self.search_subtitles_by_hash(movie_size, movie_hash, language_ids)
+
+    def search_subtitles_cached(self, movie_size, movie_hash, language_ids="heb,eng", latencies=None):
+        # The latency of the provider goes to latencies only when it was actually queried
+        engine_name = self.__class__.__name__
+        result_cache = get_result_cache()
+        if result_cache is None:
+            return self.search_subtitles_timed(movie_size, movie_hash, language_ids, latencies)
+
+        key = result_cache.get_key(engine_name, movie_hash, movie_size, language_ids)
+        subtitles, state = result_cache.lookup(key)
+        get_metrics().count("result_cache", engine=engine_name, state=state)
+        if state == result_cache.FRESH:
+            log(f"{engine_name}.search_subtitles", "Results Cache Hit.")
+            return subtitles
+        if state == result_cache.STALE:
+            log(f"{engine_name}.search_subtitles", "Results Cache Stale Hit, Refreshing In Background.")
+            with self.refresh_lock:
+                if not self.refreshing:
+                    self.refreshing = True
+                    threading.Thread(
+                        target=self.refresh_subtitles,
+                        args=(result_cache, key, movie_size, movie_hash, language_ids)
+                    ).start()
+            return subtitles
+
+        try:
+            subtitles = self.search_subtitles_timed(movie_size, movie_hash, language_ids, latencies)
+        except Exception:
+            # Provider is down, an expired result is better than nothing
+            if state == result_cache.EXPIRED:
+                log(f"{engine_name}.search_subtitles", "Search Failed, Using Expired Results.")
+                return subtitles
+            raise
+        if subtitles is not None:
+            result_cache.store(key, subtitles)
+        return subtitles
+
+    def search_subtitles_timed(self, movie_size, movie_hash, language_ids, latencies=None):
+        start = time()
+        subtitles = self.search_subtitles_with_token(movie_size, movie_hash, language_ids)
+        if latencies is not None:
+            latencies.append(time() - start)
+        return subtitles
+
+    def refresh_subtitles(self, result_cache, key, movie_size, movie_hash, language_ids):
+        # The search deadline was meant for the dialog, not for the background refresh
+        self.deadline = None
+        try:
+            subtitles = self.search_subtitles_with_token(movie_size, movie_hash, language_ids)
+            if subtitles is not None:
+                result_cache.store(key, subtitles)
+        except Exception as ex:
+            log(f"{self.__class__.__name__}.refresh_subtitles", f"ERROR: {ex}.")
+        finally:
+            with self.refresh_lock:
+                self.refreshing = False
+                closed = self.closed
+            if closed:
+                self.close()
+
+    def open_request(self, req, timeout=None):
+        engine_name = self.__class__.__name__
+        res = self.session.open(req, timeout=timeout)
+        metrics = get_metrics()
+        metrics.count("bytes_sent", len(req.data or b""), engine=engine_name)
+        # Compressed responses are counted as they came over the wire
+        wire_length = getattr(res, "wire_length", None) or res.headers.get("Content-Length")
+        metrics.count("bytes_received", int(wire_length or 0), engine=engine_name)
+        return res
+
+    def call_api(self, func_name, send, on_error=None, tries=None):
+        engine_name = self.__class__.__name__
+        log(f"{engine_name}.api_request", f"Sending request: {func_name}.")
+        circuit_breaker = get_circuit_breaker()
+        try:
+            with get_metrics().span(API_PHASES.get(func_name, func_name), engine=engine_name, function=func_name):
+                result = get_retry_policy().call(
+                    send, deadline=self.deadline, on_error=on_error, name=f"{engine_name}.api_request", tries=tries
+                )
+        except RetriesExhausted:
+            # Rejected requests fail at once and do not count against the engine
+            circuit_breaker.record_failure(engine_name)
+            raise
+        circuit_breaker.record_success(engine_name)
+        return result
+
     def download_subtitles(self, download_url, dest_path):
-        session = get_session(proxies=self.proxies, http_10=True)
-        session.addheaders = [("User-Agent", "Mozilla/4.0 (compatible; Synapse)"),
-                              ("Content-Length", 0)]
-        res = session.open(download_url)
+        host = urlparse(download_url).netloc
+        headers = {"User-Agent": "Mozilla/4.0 (compatible; Synapse)", "Content-Length": 0}
+        res = None
+        if host not in HTTP10_HOSTS:
+            try:
+                res = self.session.open(Request(download_url, headers=dict(headers, **{"Accept-Encoding": "identity"})))
+            except Exception as ex:
+                log("BSPlayerSubtitleEngine.download_subtitles", f"Keep-Alive Request Failed ({ex}), Using HTTP/1.0.")
+                HTTP10_HOSTS.add(host)
+        if res is None:
+            session = get_session(proxies=self.proxies, http_10=True)
+            session.addheaders = list(headers.items())
+            res = session.open(download_url)
         if res:
-            gf = gzip.GzipFile(fileobj=res)
-            with open(dest_path, "wb") as f:
-                f.write(gf.read())
-                f.flush()
-            gf.close()
+            size = write_atomic(iter_gzip(res), dest_path, max_size=get_max_subtitle_size())
+            get_metrics().count("bytes_received", size, engine=self.__class__.__name__)
             log("BSPlayerSubtitleEngine.download_subtitles", f"File {repr(download_url)} Download Successfully.")
             return True
         log("BSPlayerSubtitleEngine.download_subtitles", f"File {repr(download_url)} Download Failed.")
         return False
 
+    def download_subtitles_batch(self, downloads, max_workers=4):
+        def download(download_url, dest_path):
+            try:
+                return self.download_subtitles(download_url=download_url, dest_path=dest_path)
+            except Exception as ex:
+                log(f"{self.__class__.__name__}.download_subtitles_batch", f"ERROR: {ex}.")
+                return False
+
+        with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = {
+                download_url: executor.submit(download, download_url, dest_path)
+                for download_url, dest_path in downloads
+            }
+        return {download_url: result.result() for download_url, result in results.items()}
+
 
 class BSPlayer(BSPlayerSubtitleEngine):
     DOMAIN = "api.bsplayer-subtitles.com"
@@ -68,73 +267,147 @@ class BSPlayer(BSPlayerSubtitleEngine):
         "s1", "s2", "s3", "s4", "s5", "s6", "s7", "s8",
         "s101", "s102", "s103", "s104", "s105", "s106", "s107", "s108", "s109"
     ]
-
     def __init__(self, search_url=None, proxies=None, username="", password="",
-                 app_id="BSPlayer v2.7", user_agent="BSPlayer/2.x (1106.12378)"):
-        search_url = search_url or self.get_sub_domain()
+                 app_id="BSPlayer v2.7", user_agent="BSPlayer/2.x (1106.12378)", deadline=None):
+        # Stick to the mirror that issued the saved token
+        saved_session = self.get_saved_session(username, app_id) or {}
+        search_url = search_url or saved_session.get("search_url")
         super().__init__(
             search_url=search_url, proxies=proxies,
             username=username, password=password,
-            app_id=app_id, user_agent=user_agent
+            app_id=app_id, user_agent=user_agent, deadline=deadline
         )
 
-    def get_sub_domain(self, tries=5):
-        for t in range(tries):
-            domain = f"{random.choice(self.SUB_DOMAINS)}.{self.DOMAIN}"
-            try:
-                socket.gethostbyname(domain)
-                return f"http://{domain}/v1.php"
-            except socket.gaierror:
-                continue
+    @property
+    def search_url(self):
+        # The mirror is picked on the first API call, downloads never need one
+        if self._search_url is None:
+            self._search_url = self.get_sub_domain()
+        return self._search_url
+
+    @search_url.setter
+    def search_url(self, search_url):
+        self._search_url = search_url
+
+    @property
+    def mirrors(self):
+        return get_mirror_scheduler([f"{sub_domain}.{self.DOMAIN}" for sub_domain in self.SUB_DOMAINS])
+
+    def get_sub_domain(self, tries=2, exclude=()):
+        with get_metrics().span("dns", engine=self.__class__.__name__):
+            for t in range(tries):
+                domain = self.mirrors.select(exclude=exclude)
+                if domain:
+                    return f"http://{domain}/v1.php"
         raise Exception("API Domain not found")
 
-    def api_request(self, func_name, params="", tries=5, delay=1):
-        headers = {
+    def send_request(self, search_url, func_name, params, headers, timeout=None):
+        data = soap_envelope(func_name, params, search_url)
+        req = Request(search_url, data=data.encode(), headers=headers, method="POST")
+        res = self.open_request(req, timeout=timeout)
+        with get_metrics().span("parse", engine=self.__class__.__name__, function=func_name):
+            return parse_soap(res, record_factory=self.get_subtitle)
+
+    def get_headers(self, func_name):
+        return {
             "User-Agent": self.user_agent,
             "Content-Type": "text/xml; charset=utf-8",
-            "Connection": "close",
             "SOAPAction": f'"http://{self.DOMAIN}/v1.php#{func_name}"'
         }
 
-        log("BSPlayer.api_request", f"Sending request: {func_name}.")
-        for i in range(tries):
-            data = (
-                '<?xml version="1.0" encoding="UTF-8"?>\n'
-                '<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" '
-                'xmlns:SOAP-ENC="http://schemas.xmlsoap.org/soap/encoding/" '
-                'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
-                f'xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:ns1="{self.search_url}">'
-                '<SOAP-ENV:Body SOAP-ENV:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">'
-                f'<ns1:{func_name}>{params}</ns1:{func_name}></SOAP-ENV:Body></SOAP-ENV:Envelope>'
-            )
-            try:
-                req = Request(self.search_url, data=data.encode(), headers=headers, method="POST")
-                res = self.session.open(req)
-                return ElementTree.fromstring(res.read())
-            except Exception as ex:
-                log("BSPlayer.api_request", f"ERROR: {ex}.")
-                if func_name == "logIn":
-                    self.search_url = self.get_sub_domain()
-                sleep(delay)
-        log("BSPlayer.api_request", f"ERROR: Too many tries ({tries})...")
-        raise Exception("Too many tries...")
+    def get_mirror_token(self, search_url, timeout=None):
+        # Handles are only valid on the mirror that issued them, each mirror keeps its own in the token cache
+        token_cache = get_token_cache()
+        key = self.get_mirror_key(search_url)
+        saved_session = token_cache.get_token(key)
+        if saved_session:
+            return saved_session["token"]
+        res, _ = self.send_request(search_url, "logIn", soap_params(
+            ("username", self.username), ("password", self.password), ("AppID", self.app_id)
+        ), self.get_headers("logIn"), timeout)
+        if (res.get("status") or "").upper() != "OK":
+            raise Exception(f"Hedge Log In Failed, Status: {res.get('status')}.")
+        token_cache.store_token(key, res["data"], search_url)
+        return res["data"]
+
+    def get_mirror_key(self, search_url):
+        return f"{self.get_session_key(self.username, self.app_id)}|{urlparse(search_url).hostname}"
+
+    def send_hedge(self, search_url, func_name, get_params, headers, timeout=None):
+        token = self.get_mirror_token(search_url, timeout)
+        return self.send_request(search_url, func_name, get_params(token), headers, timeout)
+
+    def send_hedged_request(self, func_name, get_params, headers, timeout=None):
+        hedge_policy = get_hedge_policy()
+        domain = urlparse(self.search_url).hostname
+        executor = futures.ThreadPoolExecutor(max_workers=2)
+        start = time()
+        attempts = [executor.submit(
+            self.send_request, self.search_url, func_name, get_params(self.token), headers, timeout
+        )]
+        hedge_policy.count_request()
+        try:
+            # Only hedge requests slower than the tracked latency percentile
+            delay = hedge_policy.get_delay()
+            if delay is not None and not futures.wait(attempts, timeout=delay).done and hedge_policy.allow():
+                hedge_domain = next((d for d in self.mirrors.rank() if d != domain), None)
+                if hedge_domain:
+                    log("BSPlayer.api_request", f"Hedging {func_name} After {delay:.2f}s On {hedge_domain}.")
+                    hedge_policy.count_hedge()
+                    attempts.append(executor.submit(
+                        self.send_hedge, f"http://{hedge_domain}/v1.php", func_name, get_params, headers, timeout
+                    ))
+
+            error = None
+            for attempt in futures.as_completed(attempts):
+                try:
+                    response = attempt.result()
+                except Exception as ex:
+                    error = ex
+                    continue
+                # A hedge rejected by its mirror does not win the race, its saved handle is dropped
+                res, _ = response
+                status = (res.get("status") or "").upper()
+                if attempt is not attempts[0] and status != "OK":
+                    log("BSPlayer.api_request", f"Hedged {func_name} Status: {status}, Ignored.")
+                    if self.is_token_rejected(status):
+                        get_token_cache().drop_token(self.get_mirror_key(f"http://{hedge_domain}/v1.php"))
+                    continue
+                hedge_policy.record(time() - start)
+                return response
+            raise error
+        finally:
+            executor.shutdown(wait=False)
+
+    def api_request(self, func_name, params="", tries=None, get_params=None):
+        # Read-only calls that are safe to send to two mirrors build their params for the handle of either one
+        headers = self.get_headers(func_name)
+
+        def send(timeout):
+            # Hedges log in on their own mirror once, without the token cache every hedge would need a new login
+            if get_params and get_setting("hedge_requests", False) and get_token_cache() is not None:
+                return self.send_hedged_request(func_name, get_params, headers, timeout)
+            return self.send_request(self.search_url, func_name, params, headers, timeout)
+
+        def on_error(ex):
+            domain = urlparse(self.search_url).hostname
+            self.mirrors.report(domain, error=True)
+            if func_name == "logIn":
+                self.search_url = self.get_sub_domain(exclude=(domain,))
+
+        return self.call_api(func_name, send, on_error=on_error, tries=tries)
 
     def login(self):
         # If already logged in
         if self.token:
             return True
 
-        root = self.api_request(
+        res, _ = self.api_request(
             func_name="logIn",
-            params=(
-                f"<username>{self.username}</username>"
-                f"<password>{self.password}</password>"
-                f"<AppID>{self.app_id}</AppID>"
-            )
+            params=soap_params(("username", self.username), ("password", self.password), ("AppID", self.app_id))
         )
-        res = root.find(".//return")
-        if res.find("status").text.upper() == "OK":
-            self.token = res.find("data").text
+        if (res.get("status") or "").upper() == "OK":
+            self.token = res["data"]
             log("BSPlayer.login", "Logged In Successfully.")
             return True
         log("BSPlayer.login", "Logged In Failed.")
@@ -145,64 +418,53 @@ class BSPlayer(BSPlayerSubtitleEngine):
         if not self.token:
             return True
 
-        root = self.api_request(
+        res, _ = self.api_request(
             func_name="logOut",
-            params=f"<handle>{self.token}</handle>"
+            params=soap_params(("handle", self.token))
         )
-        res = root.find(".//return")
         self.token = None
-        if res.find("status").text.upper() == "OK":
+        if (res.get("status") or "").upper() == "OK":
             log("BSPlayer.logout", "Logged Out Successfully.")
             return True
         return False
 
-    def search_subtitles(self, movie_path, language_ids="heb,eng", logout=False):
-        if not self.login():
-            return None
+    @staticmethod
+    def get_subtitle(item):
+        return Subtitle(
+            subID=item.get("subID"),
+            subDownloadLink=item.get("subDownloadLink"),
+            subLang=item.get("subLang"),
+            subName=item.get("subName"),
+            subFormat=item.get("subFormat"),
+            subRating=item.get("subRating")
+        )
 
-        if isinstance(language_ids, (tuple, list, set)):
-            language_ids = ",".join(language_ids)
+    @staticmethod
+    def is_token_rejected(status):
+        # Invalid or expired handles are reported through the search status
+        return any(word in status for word in ("HANDLE", "LOGIN", "AUTH"))
 
-        try:
-            movie_size, movie_hash = movie_size_and_hash(movie_path)
-        except Exception as ex:
-            log("BSPlayer.search_subtitles", f"Error Calculating Movie Size / Hash: {ex}.")
-            return []
+    def search_subtitles_by_hash(self, movie_size, movie_hash, language_ids="heb,eng"):
+        if not self.login():
+            return None
 
-        log("BSPlayer.search_subtitles", f"Movie Size: {movie_size}, Movie Hash: {movie_hash}.")
-        root = self.api_request(
-            func_name="searchSubtitles",
-            params=(
-                f"<handle>{self.token}</handle>"
-                f"<movieHash>{movie_hash}</movieHash>"
-                f"<movieSize>{movie_size}</movieSize>"
-                f"<languageId>{language_ids}</languageId>"
-                "<imdbId>*</imdbId>"
+        def get_params(token):
+            return soap_params(
+                ("handle", token), ("movieHash", movie_hash), ("movieSize", movie_size),
+                ("languageId", language_ids), ("imdbId", "*")
             )
+
+        res, subtitles = self.api_request(
+            func_name="searchSubtitles", params=get_params(self.token), get_params=get_params
         )
-        res = root.find(".//return/result")
-        status = res.find("status").text.upper()
+        status = (res.get("status") or "").upper()
         if status != "OK":
             log("BSPlayer.search_subtitles", f"Status: {status}.")
+            if self.is_token_rejected(status):
+                raise TokenRejected(status)
             return []
 
-        items = root.findall(".//return/data/item") or []
-        subtitles = []
-        for item in items:
-            subtitle = dict(
-                subID=item.find("subID").text,
-                subDownloadLink=item.find("subDownloadLink").text,
-                subLang=item.find("subLang").text,
-                subName=item.find("subName").text,
-                subFormat=item.find("subFormat").text,
-                subRating=item.find("subRating").text or "0"
-            )
-            subtitles.append(subtitle)
-        log("BSPlayer.search_subtitles", f"Subtitles Found: {json.dumps(subtitles)}.")
-
-        if logout:
-            self.logout()
-
+        log("BSPlayer.search_subtitles", lambda: f"Subtitles Found: {json.dumps([dict(s) for s in subtitles])}.")
         return subtitles
 
 
@@ -210,59 +472,40 @@ class OpenSubtitles(BSPlayerSubtitleEngine):
     DOMAIN = "bsplayer.api.opensubtitles.org"
 
     def __init__(self, username, password, search_url=None, proxies=None,
-                 app_id="BSPlayer v2.78", user_agent="XmlRpc"):
+                 app_id="BSPlayer v2.78", user_agent="XmlRpc", deadline=None):
         search_url = search_url or f"http://{self.DOMAIN}/xml-rpc"
         super().__init__(
             search_url=search_url, proxies=proxies,
             username=username, password=password,
-            app_id=app_id, user_agent=user_agent
+            app_id=app_id, user_agent=user_agent, deadline=deadline
         )
 
-    def api_request(self, func_name, params="", tries=5, delay=1):
+    def api_request(self, func_name, params="", tries=None):
         headers = {
             "User-Agent": self.user_agent,
             "Accept": "text/*",
             "Content-Type": "text/xml",
             "Pragma": "no-cache",
-            "Connection": "close",
         }
+        data = xmlrpc_envelope(func_name, params)
 
-        log("OpenSubtitles.api_request", f"Sending request: {func_name}.")
-        for i in range(tries):
-            data = (
-                '<?xml version="1.0"?>\n'
-                f'<methodCall><methodName>{func_name}</methodName>\n'
-                f'<params>{params}</params>'
-                '</methodCall>'
-            )
-            try:
-                req = Request(self.search_url, data=data.encode(), headers=headers, method="POST")
-                res = self.session.open(req)
-                return ElementTree.fromstring(res.read())
-            except Exception as ex:
-                log("OpenSubtitles.api_request", f"ERROR: {ex}.")
-                sleep(delay)
-        log("OpenSubtitles.api_request", f"ERROR: Too many tries ({tries})...")
-        raise Exception("Too many tries...")
+        def send(timeout):
+            req = Request(self.search_url, data=data.encode(), headers=headers, method="POST")
+            res = self.open_request(req, timeout=timeout)
+            with get_metrics().span("parse", engine=self.__class__.__name__, function=func_name):
+                return parse_xmlrpc(res)
+
+        return self.call_api(func_name, send, tries=tries)
 
     def login(self):
         # If already logged in
         if self.token:
             return True
 
-        root = self.api_request(
+        res = self.api_request(
             func_name="LogIn",
-            params=(
-                f'<param><value>{self.username}</value></param>'
-                f'<param><value>{self.password}</value></param>'
-                f'<param><value>en</value></param><param><value>{self.app_id}</value></param>'
-            )
+            params=xmlrpc_params(self.username, self.password, "en", self.app_id)
         )
-
-        res = {
-            member.find("name").text: member.find("value/*").text
-            for member in root.findall(".//struct//member")
-        }
         if res.get("status", "").upper() == "200 OK":
             self.token = res["token"]
             log("OpenSubtitles.login", "Logged In Successfully.")
@@ -275,77 +518,48 @@ class OpenSubtitles(BSPlayerSubtitleEngine):
         if not self.token:
             return True
 
-        root = self.api_request(
+        res = self.api_request(
             func_name="LogOut",
-            params=f"<param><value>{self.token}</value></param>"
+            params=xmlrpc_params(self.token)
         )
-        res = {
-            member.find("name").text: member.find("value/*").text
-            for member in root.findall(".//struct//member")
-        }
         if res.get("status", "").upper() == "200 OK":
             self.token = None
             log("OpenSubtitles.logout", "Logged Out Successfully.")
             return True
         return False
 
-    def search_subtitles(self, movie_path, language_ids="heb,eng", logout=False):
+    @staticmethod
+    def is_token_rejected(status):
+        # 401 Unauthorized, 406 No session
+        return status.startswith("401") or status.startswith("406")
+
+    def search_subtitles_by_hash(self, movie_size, movie_hash, language_ids="heb,eng"):
         if not self.login():
             return None
 
-        if isinstance(language_ids, (tuple, list, set)):
-            language_ids = ",".join(language_ids)
-
-        try:
-            movie_size, movie_hash = movie_size_and_hash(movie_path)
-        except Exception as ex:
-            log("OpenSubtitles.search_subtitles", f"Error Calculating Movie Size / Hash: {ex}.")
-            return []
-
-        log("OpenSubtitles.search_subtitles", f"Movie Size: {movie_size}, Movie Hash: {movie_hash}.")
-        root = self.api_request(
+        res = self.api_request(
             func_name="SearchSubtitles",
-            params=(
-                f"<param><value>{self.token}</value></param>"
-                "<param><value><array><data><value><struct>"
-                "<member><name>imdbid</name><value><string/></value></member>"
-                f"<member><name>moviebytesize</name><value><double>{movie_size}.000000</double></value></member>"
-                f"<member><name>moviehash</name><value>{movie_hash}</value></member>"
-                f"<member><name>sublanguageid</name><value>{language_ids}</value></member>"
-                "</struct></value></data></array></value></param>"
-            )
+            params=opensubtitles_search_params(self.token, movie_size, movie_hash, language_ids)
         )
-        res = {
-            member.find("name").text: member.find("value/*").text
-            for member in root.findall(".//struct//member")
-        }
         status = res.get("status", "").upper()
         if status != "200 OK":
             log("OpenSubtitles.search_subtitles", f"Status: {status}.")
+            if self.is_token_rejected(status):
+                raise TokenRejected(status)
             return []
 
-        items = [
-            {
-                member.find("name").text: member.find("value/*").text
-                for member in item.findall(".//struct//member")
-            } for item in root.findall(".//member/value/array/data/value")
-        ]
-        subtitles = []
-        for item in items:
-            subtitle = dict(
+        # "data" is False when nothing was found
+        subtitles = [
+            Subtitle(
                 subID=item.get("IDSubtitle"),
                 subDownloadLink=item.get("SubDownloadLink"),
                 subLang=item.get("SubLanguageID"),
                 subName=item.get("SubFileName"),
                 subFormat=item.get("SubFormat"),
-                subRating=item.get("SubRating") or "0"
-            )
-            subtitles.append(subtitle)
-        log("OpenSubtitles.search_subtitles", f"Subtitles Found: {json.dumps(subtitles)}.")
-
-        if logout:
-            self.logout()
-
+                subRating=item.get("SubRating")
+            ) for item in res.get("data") or []
+        ]
+        log("OpenSubtitles.search_subtitles", lambda: f"Subtitles Found: {json.dumps([dict(s) for s in subtitles])}.")
         return subtitles
 
 
@@ -353,12 +567,12 @@ class GetSubtitle(BSPlayerSubtitleEngine):
     DOMAIN = "api.getsubtitle.com"
 
     def __init__(self, search_url=None, proxies=None, username="", password="",
-                 app_id="", user_agent="gSOAP/2.7"):
+                 app_id="", user_agent="gSOAP/2.7", deadline=None):
         search_url = search_url or f"http://{self.DOMAIN}/server.php"
         super().__init__(
             search_url=search_url, proxies=proxies,
             username=username, password=password,
-            app_id=app_id, user_agent=user_agent
+            app_id=app_id, user_agent=user_agent, deadline=deadline
         )
 
     def login(self):
@@ -369,108 +583,79 @@ class GetSubtitle(BSPlayerSubtitleEngine):
         log("GetSubtitle.logout", "Logged Out Successfully.")
         return True
 
-    def api_request(self, func_name, params="", tries=5, delay=1):
+    def api_request(self, func_name, params="", tries=None):
         headers = {
             "User-Agent": self.user_agent,
             "Content-Type": "text/xml; charset=utf-8",
-            "Connection": "close",
             "SOAPAction": f'"{func_name}_wsdl#{func_name}"',
         }
-        soap_env = (
-            '<?xml version="1.0" encoding="UTF-8"?>\n'
-            '<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" '
-            'xmlns:SOAP-ENC="http://schemas.xmlsoap.org/soap/encoding/" '
-            'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
-            'xmlns:xsd="http://www.w3.org/2001/XMLSchema" '
-            'xmlns:ns1="http://173.242.116.50/~admin/nusoap" '
-            'xmlns:ns2="searchSubtitles_wsdl" '
-            'xmlns:ns3="searchSubtitlesByHash_wsdl" '
-            'xmlns:ns4="findSubtitlesByHash_wsdl" '
-            'xmlns:ns5="downloadSubtitles_wsdl" '
-            'xmlns:ns6="getLanguages_wsdl" '
-            'xmlns:ns7="getFilesName_wsdl" '
-            'xmlns:ns8="uploadSubtitle_wsdl" '
-            'xmlns:ns9="uploadSubtitle2_wsdl">'
-        )
-        log("GetSubtitle.api_request", f"Sending request: {func_name}.")
-        for i in range(tries):
-            namespace = re.search(fr'xmlns:(?P<ns>ns\d+)="{func_name}_wsdl"', soap_env).group('ns')
-            data = soap_env + (
-                f'<SOAP-ENV:Body SOAP-ENV:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">'
-                f'<{namespace}:{func_name}>{params}</{namespace}:{func_name}></SOAP-ENV:Body></SOAP-ENV:Envelope>'
-            )
-            try:
-                req = Request(self.search_url, data=data.encode(), headers=headers, method="POST")
-                res = self.session.open(req)
-                return ElementTree.fromstring(res.read())
-            except Exception as ex:
-                log("GetSubtitle.api_request", f"ERROR: {ex}.")
-                sleep(delay)
-        log("GetSubtitle.api_request", f"ERROR: Too many tries ({tries})...")
-        raise Exception("Too many tries...")
+        data = getsubtitle_envelope(func_name, params)
 
-    def search_subtitles(self, movie_path, language_ids="heb,eng", logout=False):
-        if isinstance(language_ids, (tuple, list, set)):
-            language_ids = ",".join(language_ids)
+        def send(timeout):
+            req = Request(self.search_url, data=data.encode(), headers=headers, method="POST")
+            res = self.open_request(req, timeout=timeout)
+            with get_metrics().span("parse", engine=self.__class__.__name__, function=func_name):
+                return parse_soap(res)
 
-        try:
-            movie_size, movie_hash = movie_size_and_hash(movie_path)
-        except Exception as ex:
-            log("GetSubtitle.search_subtitles", f"Error Calculating Movie Size / Hash: {ex}.")
-            return []
+        return self.call_api(func_name, send, tries=tries)
 
-        log("GetSubtitle.search_subtitles", f"Movie Size: {movie_size}, Movie Hash: {movie_hash}.")
-        root = self.api_request(
+    def search_subtitles_by_hash(self, movie_size, movie_hash, language_ids="heb,eng"):
+        _, items = self.api_request(
             func_name="searchSubtitlesByHash",
-            params=(
-                f"<hash>{movie_hash}</hash>"
-                f"<language>{language_ids}</language>"
-                "<index>0</index>"
-                "<count>100</count>"
-            )
+            params=soap_params(("hash", movie_hash), ("language", language_ids), ("index", 0), ("count", 100))
         )
         subtitles = []
-        for item in root.findall(".//return/item") or []:
-            filename = item.find("file_name").text
-            cod_subtitle_file = item.find("cod_subtitle_file").text
+        for item in items:
+            filename = item["file_name"]
+            cod_subtitle_file = item["cod_subtitle_file"]
             query_string = urlencode(dict(
                 cod_subtitle_file=cod_subtitle_file,
                 movie_hash=movie_hash
             ))
-            subtitle = dict(
+            subtitle = Subtitle(
                 subID=cod_subtitle_file,
                 subDownloadLink=f"http://api.getsubtitle.com/?{query_string}",
-                subLang=item.find("desc_reduzido").text,
+                subLang=item["desc_reduzido"],
                 subName=filename,
                 subFormat=filename.split(".")[-1],
                 subRating="0"
             )
             subtitles.append(subtitle)
-        log("GetSubtitle.search_subtitles", f"Subtitles Found: {json.dumps(subtitles)}.")
-
-        if logout:
-            self.logout()
-
+        log("GetSubtitle.search_subtitles", lambda: f"Subtitles Found: {json.dumps([dict(s) for s in subtitles])}.")
         return subtitles
 
     def download_subtitles(self, download_url, dest_path):
-        url = urlparse(download_url)
-        params = dict(parse_qsl(url.query))
-        root = self.api_request(
+        return self.download_subtitles_batch([(download_url, dest_path)])[download_url]
+
+    def download_subtitles_batch(self, downloads, max_workers=4):
+        # downloadSubtitles takes an array, every subtitle is fetched in a single request
+        requested = [(download_url, dest_path, dict(parse_qsl(urlparse(download_url).query)))
+                     for download_url, dest_path in downloads]
+        results = {download_url: False for download_url, _, _ in requested}
+        if not requested:
+            return results
+
+        _, items = self.api_request(
             func_name="downloadSubtitles",
-            params=(
-                '<subtitles xsi:type="SOAP-ENC:Array" SOAP-ENC:arrayType="ns1:SubtitleDownload[1]"><item>'
-                f'<movie_hash>{params["movie_hash"]}</movie_hash>'
-                f'<cod_subtitle_file>{params["cod_subtitle_file"]}</cod_subtitle_file>'
-                '</item></subtitles>'
-            )
+            params=getsubtitle_download_params([
+                (params["movie_hash"], params["cod_subtitle_file"]) for _, _, params in requested
+            ])
         )
-        res = root.find(".//return/item/data")
-        if res is not None:
-            with open(dest_path, "wb") as f:
-                f.write(zlib.decompress(b64decode(res.text)))
-                f.flush()
+        items_by_cod = {item.get("cod_subtitle_file"): item for item in items if item.get("cod_subtitle_file")}
+        for i, (download_url, dest_path, params) in enumerate(requested):
+            # Items are matched by position only when the server does not name them, a missing one is a failure
+            if items_by_cod:
+                item = items_by_cod.get(params["cod_subtitle_file"]) or {}
+            else:
+                item = items[i] if i < len(items) else {}
+            if item.get("data") is None:
+                log("GetSubtitle.download_subtitles", f"File {repr(download_url)} Download Failed.")
+                continue
+            try:
+                write_atomic(iter_base64_zlib(item["data"]), dest_path, max_size=get_max_subtitle_size())
+            except Exception as ex:
+                log("GetSubtitle.download_subtitles", f"File {repr(download_url)} Download Failed: {ex}.")
+                continue
             log("GetSubtitle.download_subtitles", f"File {repr(download_url)} Download Successfully.")
-            return True
-        log("GetSubtitle.download_subtitles", f"File {repr(download_url)} Download Failed.")
-        return False
+            results[download_url] = True
+        return results
@@ -0,0 +1,313 @@
+import json
+import time
+import shutil
+import hashlib
+import threading
+from os import path, makedirs
+
+from .codec import Subtitle
+from .storage import JSONStore
+from .metrics import get_metrics
+from .utils import (
+    movie_size_and_hash as read_movie_size_and_hash, is_rar_file, is_remote_path, read_rar_index,
+    get_remote_stat, get_file_stat, get_setting, file, log, PROFILE_PATH
+)
+
+SIDECAR_EXT = ".bsphash"
+
+
+class RarIndexCache(JSONStore):
+    def __init__(self, max_entries=100):
+        super().__init__("rar_index.json", max_entries=max_entries)
+
+    def get_index(self, file_path):
+        try:
+            file_size, file_mtime = get_file_stat(file_path)
+        except Exception as ex:
+            log("RarIndexCache.get_index", f"Stat Failed, Index Not Cached: {ex}.")
+            return read_rar_index(file_path)
+
+        key = f"{file_path}|{file_size}|{file_mtime}"
+        rar_index = self.get(key)
+        get_metrics().count("rar_index_cache", result="miss" if rar_index is None else "hit")
+        if rar_index is None:
+            rar_index = read_rar_index(file_path)
+            self.set(key, rar_index)
+        return rar_index
+
+
+rar_index_cache = None
+
+
+def get_rar_index_cache():
+    global rar_index_cache
+    if rar_index_cache is None:
+        rar_index_cache = RarIndexCache()
+    return rar_index_cache
+
+
+def calc_movie_size_and_hash(file_path):
+    if is_rar_file(file_path):
+        # The release headers are indexed once, later hashes only read the two body windows
+        return read_movie_size_and_hash(file_path, rar_index=get_rar_index_cache().get_index(file_path))
+    return read_movie_size_and_hash(file_path)
+
+
+class HashCache(JSONStore):
+    def __init__(self, max_entries=500, sidecar=False):
+        super().__init__("hashes.json", max_entries=max_entries)
+        self.sidecar = sidecar
+        self.hash_locks = {}
+        # Streams are only remembered in memory, for the length of the run
+        self.remote_stats = {}
+        self.remote_hashes = {}
+
+    @staticmethod
+    def get_key(file_path, file_size, file_mtime):
+        return f"{file_path}|{file_size}|{file_mtime}"
+
+    @staticmethod
+    def read_sidecar(file_path, file_size, file_mtime):
+        try:
+            f = file(file_path + SIDECAR_EXT, "r")
+            try:
+                sidecar = json.loads(f.read(4096))
+            finally:
+                f.close()
+        except Exception:
+            return None
+        if sidecar.get("size") == file_size and sidecar.get("mtime") == file_mtime:
+            return sidecar["movie_size"], sidecar["movie_hash"]
+        return None
+
+    @staticmethod
+    def write_sidecar(file_path, file_size, file_mtime, movie_size, movie_hash):
+        try:
+            f = file(file_path + SIDECAR_EXT, "w")
+            try:
+                f.write(json.dumps(dict(
+                    size=file_size, mtime=file_mtime,
+                    movie_size=movie_size, movie_hash=movie_hash
+                )))
+            finally:
+                f.close()
+        except Exception as ex:
+            log("HashCache.write_sidecar", f"ERROR: {ex}.")
+
+    def get_hash_lock(self, key):
+        with self.lock:
+            return self.hash_locks.setdefault(key, threading.Lock())
+
+    def reset_remote(self):
+        # Stream hashes are kept, a new run only checks the size and validator again
+        with self.lock:
+            self.remote_stats = {}
+            while self.max_entries and len(self.remote_hashes) > self.max_entries:
+                self.remote_hashes.pop(next(iter(self.remote_hashes)))
+
+    def remote_movie_size_and_hash(self, file_url):
+        # Engines searching the same stream share a single HEAD and the two range requests
+        with self.get_hash_lock(file_url):
+            remote_stat = self.remote_stats.get(file_url)
+            if remote_stat is None:
+                remote_stat = self.remote_stats[file_url] = get_remote_stat(file_url)
+            key = (file_url,) + remote_stat
+            cached = self.remote_hashes.get(key)
+            get_metrics().count("hash_cache", result="miss" if cached is None else "memo")
+            if cached is None:
+                cached = self.remote_hashes[key] = read_movie_size_and_hash(file_url, remote_stat=remote_stat)
+            return cached
+
+    def movie_size_and_hash(self, file_path):
+        if is_remote_path(file_path):
+            # Streams have no mtime to key on and no place for a sidecar, they are never persisted
+            return self.remote_movie_size_and_hash(file_path)
+
+        try:
+            file_size, file_mtime = get_file_stat(file_path)
+        except Exception as ex:
+            log("HashCache.movie_size_and_hash", f"Stat Failed, Hash Not Cached: {ex}.")
+            return calc_movie_size_and_hash(file_path)
+
+        key = self.get_key(file_path, file_size, file_mtime)
+        # Engines searching concurrently wait for a single hash calculation, other files are hashed side by side
+        with self.get_hash_lock(key):
+            cached = self.get(key)
+            if cached:
+                log("HashCache.movie_size_and_hash", f"Cache Hit: {file_path}.")
+                get_metrics().count("hash_cache", result="hit")
+                return tuple(cached)
+
+            cached = self.read_sidecar(file_path, file_size, file_mtime) if self.sidecar else None
+            if cached:
+                log("HashCache.movie_size_and_hash", f"Sidecar Hit: {file_path}.")
+                get_metrics().count("hash_cache", result="sidecar")
+                movie_size, movie_hash = cached
+            else:
+                get_metrics().count("hash_cache", result="miss")
+                movie_size, movie_hash = calc_movie_size_and_hash(file_path)
+                if self.sidecar:
+                    self.write_sidecar(file_path, file_size, file_mtime, movie_size, movie_hash)
+            self.set(key, [movie_size, movie_hash])
+            return movie_size, movie_hash
+
+
+hash_cache = None
+
+
+def get_hash_cache():
+    global hash_cache
+    if hash_cache is None:
+        hash_cache = HashCache(
+            max_entries=get_setting("hash_cache_size", 500),
+            sidecar=get_setting("hash_sidecar", False)
+        )
+    return hash_cache
+
+
+def movie_size_and_hash(file_path):
+    if not get_setting("hash_cache", True):
+        return calc_movie_size_and_hash(file_path)
+    return get_hash_cache().movie_size_and_hash(file_path)
+
+
+class ResultCache(JSONStore):
+    FRESH = "fresh"
+    STALE = "stale"
+    EXPIRED = "expired"
+    MISSING = "missing"
+
+    def __init__(self, ttl=3600, negative_ttl=600, stale_ttl=86400, max_entries=200):
+        super().__init__("results.json", max_entries=max_entries)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
+
+    @staticmethod
+    def get_key(engine_name, movie_hash, movie_size, language_ids):
+        if isinstance(language_ids, str):
+            language_ids = language_ids.split(",")
+        return f"{engine_name}|{movie_hash}|{movie_size}|{','.join(sorted(language_ids))}"
+
+    def lookup(self, key):
+        entry = self.get(key)
+        if not entry:
+            return None, self.MISSING
+
+        subtitles = [Subtitle(**subtitle) for subtitle in entry["subtitles"]]
+        age = time.time() - entry["time"]
+        # Searches that found nothing expire sooner
+        ttl = self.ttl if subtitles else self.negative_ttl
+        if age <= ttl:
+            return subtitles, self.FRESH
+        if age <= ttl + self.stale_ttl:
+            return subtitles, self.STALE
+        return subtitles, self.EXPIRED
+
+    def store(self, key, subtitles):
+        self.set(key, dict(time=time.time(), subtitles=[dict(subtitle) for subtitle in subtitles]))
+
+
+result_cache = None
+
+
+def get_result_cache():
+    global result_cache
+    if not get_setting("result_cache", True):
+        return None
+    if result_cache is None:
+        result_cache = ResultCache(
+            ttl=get_setting("result_cache_ttl", 60) * 60,
+            negative_ttl=get_setting("result_cache_negative_ttl", 10) * 60,
+            stale_ttl=get_setting("result_cache_stale_ttl", 24) * 3600
+        )
+    return result_cache
+
+
+class TokenCache(JSONStore):
+    def __init__(self, ttl=600):
+        super().__init__("tokens.json")
+        self.ttl = ttl
+
+    def get_token(self, key):
+        entry = self.get(key)
+        if not entry or entry["expires"] < time.time():
+            return None
+        return entry
+
+    def store_token(self, key, token, search_url):
+        # Sliding expiry, every use keeps the token alive
+        self.set(key, dict(token=token, search_url=search_url, expires=time.time() + self.ttl))
+
+    def drop_token(self, key):
+        if key in self.data:
+            self.pop(key)
+
+
+token_cache = None
+
+
+def get_token_cache():
+    global token_cache
+    if not get_setting("reuse_tokens", True):
+        return None
+    if token_cache is None:
+        token_cache = TokenCache(ttl=get_setting("token_ttl", 10) * 60)
+    return token_cache
+
+
+class SubtitleStore(JSONStore):
+    def __init__(self, max_size=50 * 1024 * 1024):
+        super().__init__("subtitles.json")
+        self.root = path.join(PROFILE_PATH, "subtitles")
+        self.max_size = max_size
+
+    @staticmethod
+    def get_key(engine_name, download_link):
+        return hashlib.sha1(f"{engine_name}|{download_link}".encode()).hexdigest()
+
+    def get_path(self, engine_name, download_link, file_name):
+        key = self.get_key(engine_name, download_link)
+        directory = path.join(self.root, key)
+        makedirs(directory, exist_ok=True)
+        return path.join(directory, path.basename(file_name))
+
+    def lookup(self, engine_name, download_link):
+        key = self.get_key(engine_name, download_link)
+        entry = self.get(key)
+        if not entry or not path.isfile(entry["path"]):
+            if entry:
+                self.pop(key)
+            get_metrics().count("subtitle_store", result="miss")
+            return None
+        self.save()
+        get_metrics().count("subtitle_store", result="hit")
+        return entry["path"]
+
+    def discard(self, engine_name, download_link):
+        # A failed download leaves nothing behind, subtitles already stored under the same key are kept
+        with self.lock:
+            key = self.get_key(engine_name, download_link)
+            if key not in self.data:
+                shutil.rmtree(path.join(self.root, key), ignore_errors=True)
+
+    def add(self, engine_name, download_link, file_path):
+        with self.lock:
+            key = self.get_key(engine_name, download_link)
+            self.set(key, dict(path=file_path, size=path.getsize(file_path)), save=False)
+            # Least recently used subtitles are removed first
+            while len(self.data) > 1 and sum(entry["size"] for entry in self.data.values()) > self.max_size:
+                evicted_key = next(iter(self.data))
+                self.pop(evicted_key, save=False)
+                shutil.rmtree(path.join(self.root, evicted_key), ignore_errors=True)
+            self.save()
+
+
+subtitle_store = None
+
+
+def get_subtitle_store():
+    global subtitle_store
+    if subtitle_store is None:
+        subtitle_store = SubtitleStore(max_size=get_setting("subtitle_store_size", 50) * 1024 * 1024)
+    return subtitle_store
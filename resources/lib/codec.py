@@ -0,0 +1,154 @@
+from xmlrpc import client
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+CHUNK_SIZE = 16384
+
+SOAP_ENVELOPE = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" '
+    'xmlns:SOAP-ENC="http://schemas.xmlsoap.org/soap/encoding/" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+    'xmlns:xsd="http://www.w3.org/2001/XMLSchema" {namespaces}>'
+    '<SOAP-ENV:Body SOAP-ENV:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">'
+    '<{ns}:{func_name}>{params}</{ns}:{func_name}></SOAP-ENV:Body></SOAP-ENV:Envelope>'
+)
+GETSUBTITLE_NAMESPACES = {
+    "searchSubtitles": "ns2",
+    "searchSubtitlesByHash": "ns3",
+    "findSubtitlesByHash": "ns4",
+    "downloadSubtitles": "ns5",
+    "getLanguages": "ns6",
+    "getFilesName": "ns7",
+    "uploadSubtitle": "ns8",
+    "uploadSubtitle2": "ns9",
+}
+GETSUBTITLE_XMLNS = 'xmlns:ns1="http://173.242.116.50/~admin/nusoap" ' + " ".join(
+    f'xmlns:{ns}="{func_name}_wsdl"' for func_name, ns in GETSUBTITLE_NAMESPACES.items()
+)
+GETSUBTITLE_DOWNLOAD_ITEM = (
+    "<item><movie_hash>{movie_hash}</movie_hash><cod_subtitle_file>{cod_subtitle_file}</cod_subtitle_file></item>"
+)
+GETSUBTITLE_DOWNLOAD_PARAMS = (
+    '<subtitles xsi:type="SOAP-ENC:Array" SOAP-ENC:arrayType="ns1:SubtitleDownload[{count}]">{items}</subtitles>'
+)
+
+XMLRPC_ENVELOPE = (
+    '<?xml version="1.0"?>\n'
+    '<methodCall><methodName>{func_name}</methodName>\n'
+    '<params>{params}</params>'
+    '</methodCall>'
+)
+XMLRPC_PARAM = "<param><value>{}</value></param>"
+OPENSUBTITLES_SEARCH_PARAM = (
+    "<param><value><array><data><value><struct>"
+    "<member><name>imdbid</name><value><string/></value></member>"
+    "<member><name>moviebytesize</name><value><double>{movie_size}.000000</double></value></member>"
+    "<member><name>moviehash</name><value>{movie_hash}</value></member>"
+    "<member><name>sublanguageid</name><value>{language_ids}</value></member>"
+    "</struct></value></data></array></value></param>"
+)
+
+
+class Subtitle(object):
+    __slots__ = ("subID", "subDownloadLink", "subLang", "subName", "subFormat", "subRating")
+
+    def __init__(self, subID=None, subDownloadLink=None, subLang=None, subName=None, subFormat=None, subRating="0"):
+        self.subID = subID
+        self.subDownloadLink = subDownloadLink
+        self.subLang = subLang
+        self.subName = subName
+        self.subFormat = subFormat
+        self.subRating = subRating or "0"
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return self.__slots__
+
+    def __eq__(self, other):
+        return dict(self) == dict(other)
+
+    def __repr__(self):
+        return f"Subtitle({dict(self)})"
+
+
+def soap_params(*items):
+    return "".join(f"<{name}>{escape(str(value))}</{name}>" for name, value in items)
+
+
+def soap_envelope(func_name, params, namespace_url):
+    return SOAP_ENVELOPE.format(
+        namespaces=f'xmlns:ns1="{escape(namespace_url)}"', ns="ns1", func_name=func_name, params=params
+    )
+
+
+def getsubtitle_envelope(func_name, params):
+    return SOAP_ENVELOPE.format(
+        namespaces=GETSUBTITLE_XMLNS, ns=GETSUBTITLE_NAMESPACES[func_name], func_name=func_name, params=params
+    )
+
+
+def getsubtitle_download_params(downloads):
+    items = "".join(GETSUBTITLE_DOWNLOAD_ITEM.format(
+        movie_hash=escape(movie_hash), cod_subtitle_file=escape(cod_subtitle_file)
+    ) for movie_hash, cod_subtitle_file in downloads)
+    return GETSUBTITLE_DOWNLOAD_PARAMS.format(count=len(downloads), items=items)
+
+
+def xmlrpc_params(*values):
+    return "".join(XMLRPC_PARAM.format(escape(str(value))) for value in values)
+
+
+def xmlrpc_envelope(func_name, params):
+    return XMLRPC_ENVELOPE.format(func_name=func_name, params=params)
+
+
+def opensubtitles_search_params(token, movie_size, movie_hash, language_ids):
+    return xmlrpc_params(token) + OPENSUBTITLES_SEARCH_PARAM.format(
+        movie_size=int(movie_size), movie_hash=escape(movie_hash), language_ids=escape(language_ids)
+    )
+
+
+def local_name(tag):
+    return tag.rsplit("}", 1)[-1] if "}" in tag else tag
+
+
+def parse_soap(stream, record_factory=None):
+    # The C parser builds the whole tree, the Python side visits the elements outside of <item> once
+    # and turns every <item> into a record with one comprehension
+    root = ElementTree.fromstring(stream.read())
+
+    fields = {}
+    records = []
+
+    def visit(parent):
+        for elem in parent:
+            tag = elem.tag
+            if tag == "item":
+                record = {child.tag: child.text for child in elem}
+                records.append(record_factory(record) if record_factory else record)
+            elif len(elem):
+                visit(elem)
+            else:
+                fields[local_name(tag)] = elem.text
+
+    visit(root)
+    return fields, records
+
+
+def parse_xmlrpc(stream):
+    # Expat based unmarshaller fed chunk by chunk, no element tree is built
+    parser, unmarshaller = client.getparser()
+    for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+        parser.feed(chunk)
+    parser.close()
+    params = unmarshaller.close()
+    return params[0] if params else {}
@@ -0,0 +1,77 @@
+from importlib import import_module
+
+from .metrics import get_metrics
+from .scheduling import get_engine_scheduler
+from .utils import get_setting, log
+
+# Engines are imported on first use, a plugin invocation only pays for the engines it runs
+ENGINES = {
+    "BSPlayer": (".bsplayer", "BSPlayer"),
+    "OpenSubtitles": (".bsplayer", "OpenSubtitles"),
+    "GetSubtitle": (".bsplayer", "GetSubtitle"),
+}
+ENGINE_NAMES = list(ENGINES.keys())
+
+
+def get_engine(engine_name):
+    module_name, class_name = ENGINES[engine_name]
+    return getattr(import_module(module_name, __package__), class_name)
+
+
+def get_engine_kwargs(engine_name):
+    kwargs = {}
+    if engine_name == "OpenSubtitles":
+        kwargs.update({"username": get_setting("OSuser"), "password": get_setting("OSpass")})
+    return kwargs
+
+
+def search_parts(engine_name, video_paths, language_ids, deadline=None):
+    # Cached results say nothing about the provider, only parts it was queried for are recorded
+    latencies = [[] for _ in video_paths]
+    with get_engine(engine_name)(deadline=deadline, **get_engine_kwargs(engine_name)) as sub:
+        if len(video_paths) == 1:
+            parts = [sub.search_subtitles(video_paths[0], language_ids=language_ids, latencies=latencies[0]) or []]
+        else:
+            def search(video_path, part_latencies):
+                try:
+                    return sub.search_subtitles(video_path, language_ids=language_ids, latencies=part_latencies) or []
+                except Exception as ex:
+                    log(f"{engine_name}.search_parts", f"{video_path} Error: {ex}.")
+                    return []
+
+            from concurrent import futures
+
+            # Every part of a stack is hashed and searched at once, on the same login
+            with futures.ThreadPoolExecutor(max_workers=len(video_paths)) as executor:
+                parts = list(executor.map(search, video_paths, latencies))
+
+    engine_scheduler = get_engine_scheduler()
+    searched = [subtitles for subtitles, part_latencies in zip(parts, latencies) if part_latencies]
+    if engine_scheduler is not None and searched:
+        # The parts are searched at once, the slowest one is the latency of the stack
+        engine_scheduler.record(engine_name, language_ids, searched, max(sum(latencies, [])))
+    return parts
+
+
+def download_subtitle(engine_name, download_link, file_name):
+    from .cache import get_subtitle_store
+
+    subtitle_store = get_subtitle_store()
+    subtitle_path = subtitle_store.lookup(engine_name, download_link)
+    if subtitle_path:
+        log("Engines.download_subtitle", f"Subtitles Found In Store: {download_link}")
+        return subtitle_path
+
+    subtitle_path = subtitle_store.get_path(engine_name, download_link, file_name)
+    try:
+        engine = get_engine(engine_name)(**get_engine_kwargs(engine_name))
+        with get_metrics().span("download", engine=engine_name):
+            downloaded = engine.download_subtitles(download_url=download_link, dest_path=subtitle_path)
+        if downloaded:
+            log("Engines.download_subtitle", f"Subtitles Download Successfully From: {download_link}")
+            subtitle_store.add(engine_name, download_link, subtitle_path)
+            return subtitle_path
+    except Exception as ex:
+        log("Engines.download_subtitle", f"{engine_name} Error: {ex}.")
+    subtitle_store.discard(engine_name, download_link)
+    return None
@@ -0,0 +1,224 @@
+import re
+import os
+import sys
+import time
+import logging
+import argparse
+import threading
+from concurrent import futures
+
+from .storage import JSONStore
+from .engines import ENGINE_NAMES, get_engine
+from .retry import get_circuit_breaker
+from .utils import movie_size_and_hash, get_file_stat, log, VIDEO_EXTENSIONS
+from .cache import HashCache, get_hash_cache
+
+# Only the first volume of a RAR release is hashed, "movie.part2.rar" and up are skipped
+RAR_PART_PATTERN = re.compile(r"\.part0*(\d+)\.rar$", re.IGNORECASE)
+
+
+class RateLimiter(object):
+    def __init__(self, rate=2.0, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+class LibraryIndex(JSONStore):
+    def __init__(self):
+        super().__init__("library.json")
+
+    def is_fresh(self, file_path, file_size, file_mtime, engine_names, language_ids):
+        entry = self.data.get(file_path)
+        return bool(
+            entry and entry["size"] == file_size and entry["mtime"] == file_mtime
+            and entry["languages"] == language_ids and all(name in entry["subtitles"] for name in engine_names)
+        )
+
+    def store(self, file_path, file_size, file_mtime, movie_size, movie_hash, language_ids, subtitles):
+        self.set(file_path, dict(
+            size=file_size, mtime=file_mtime, movie_size=movie_size, movie_hash=movie_hash,
+            languages=language_ids, time=time.time(),
+            subtitles={
+                engine_name: [dict(subtitle) for subtitle in engine_subtitles]
+                for engine_name, engine_subtitles in subtitles.items()
+            }
+        ), save=False)
+
+
+def is_video_file(file_path):
+    if not file_path.lower().endswith(VIDEO_EXTENSIONS):
+        return False
+    match = RAR_PART_PATTERN.search(file_path)
+    return not match or int(match.group(1)) == 1
+
+
+def iter_video_files(paths):
+    for root_path in paths:
+        if os.path.isfile(root_path):
+            yield os.path.abspath(root_path)
+            continue
+        for dir_path, dir_names, file_names in os.walk(root_path):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                if is_video_file(file_name):
+                    yield os.path.abspath(os.path.join(dir_path, file_name))
+
+
+def hash_file(file_path):
+    # Runs in a worker process, hashing is CPU and IO bound and does not share the GIL with the searches
+    try:
+        return file_path, movie_size_and_hash(file_path), None
+    except Exception as ex:
+        return file_path, None, str(ex)
+
+
+def hash_files(file_paths, max_workers=None):
+    hash_cache = get_hash_cache()
+    hashes = {}
+    missing = []
+    for file_path, file_stat in file_paths.items():
+        cached = hash_cache.get(HashCache.get_key(file_path, *file_stat))
+        if cached:
+            hashes[file_path] = tuple(cached)
+        else:
+            missing.append(file_path)
+
+    log("Library.hash_files", f"Hashing {len(missing)} Files, {len(hashes)} Found In Cache.")
+    if missing:
+        with futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for file_path, file_hash, error in executor.map(hash_file, missing, chunksize=4):
+                if error:
+                    log("Library.hash_files", f"ERROR: Hashing {file_path}: {error}.")
+                    continue
+                hashes[file_path] = file_hash
+                hash_cache.set(HashCache.get_key(file_path, *file_paths[file_path]), list(file_hash), save=False)
+        hash_cache.save()
+    return hashes
+
+
+def search_engine(engine_name, engine_kwargs, hashes, language_ids, max_workers=4, rate=2.0):
+    rate_limiter = RateLimiter(rate=rate, burst=max_workers)
+    circuit_breaker = get_circuit_breaker()
+    language_ids = ",".join(language_ids)
+
+    def search(movie_size, movie_hash):
+        if not circuit_breaker.allow(engine_name):
+            raise Exception(f"{engine_name} Keeps Failing, Skipped Until Its Cool-Down Expires.")
+        rate_limiter.acquire()
+        return sub.search_subtitles_cached(movie_size, movie_hash, language_ids) or []
+
+    results = {}
+    # A single login for the whole run, every search shares the session and its pooled connections
+    with get_engine(engine_name)(**engine_kwargs) as sub:
+        with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = {
+                executor.submit(search, movie_size, movie_hash): file_path
+                for file_path, (movie_size, movie_hash) in hashes.items()
+            }
+            for future in futures.as_completed(pending):
+                file_path = pending[future]
+                try:
+                    results[file_path] = future.result()
+                except Exception as ex:
+                    log("Library.search_engine", f"{engine_name} Error: {file_path}: {ex}.")
+    return results
+
+
+def search_library(paths, language_ids, engine_kwargs, max_workers=4, rate=2.0, hash_workers=None, refresh=False):
+    index = LibraryIndex()
+    file_paths = {}
+    for file_path in iter_video_files(paths):
+        try:
+            file_stat = get_file_stat(file_path)
+        except Exception as ex:
+            log("Library.search_library", f"ERROR: {file_path}: {ex}.")
+            continue
+        if refresh or not index.is_fresh(file_path, *file_stat, list(engine_kwargs), language_ids):
+            file_paths[file_path] = file_stat
+    log("Library.search_library", f"Searching {len(file_paths)} Files.")
+    if not file_paths:
+        return {}
+
+    hashes = hash_files(file_paths, max_workers=hash_workers)
+    # Engines run side by side, each one bounded by its own workers and rate limit
+    with futures.ThreadPoolExecutor(max_workers=len(engine_kwargs) or 1) as executor:
+        pending = {
+            executor.submit(search_engine, engine_name, kwargs, hashes, language_ids, max_workers, rate): engine_name
+            for engine_name, kwargs in engine_kwargs.items()
+        }
+        results = {}
+        for future in futures.as_completed(pending):
+            engine_name = pending[future]
+            try:
+                results[engine_name] = future.result()
+            except Exception as ex:
+                log("Library.search_library", f"{engine_name} Error: {ex}.")
+
+    found = {}
+    for file_path, (movie_size, movie_hash) in hashes.items():
+        subtitles = {
+            engine_name: engine_results[file_path]
+            for engine_name, engine_results in results.items() if file_path in engine_results
+        }
+        index.store(file_path, *file_paths[file_path], movie_size, movie_hash, language_ids, subtitles)
+        found[file_path] = sum(map(len, subtitles.values()))
+    index.save()
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search BSPlayer subtitles for whole library folders.")
+    parser.add_argument("paths", nargs="+", help="video files and folders, folders are scanned recursively")
+    parser.add_argument("-l", "--languages", default="eng", help="ISO 639-2 language ids: eng,heb")
+    parser.add_argument("-e", "--engines", default=",".join(ENGINE_NAMES))
+    parser.add_argument("-w", "--workers", type=int, default=4, help="concurrent searches per engine")
+    parser.add_argument("-r", "--rate", type=float, default=2.0, help="searches per second per engine, 0 is unlimited")
+    parser.add_argument("--hash-workers", type=int, help="hashing processes, defaults to the number of CPUs")
+    parser.add_argument("--os-user", default=os.environ.get("OPENSUBTITLES_USER", ""))
+    parser.add_argument("--os-pass", default=os.environ.get("OPENSUBTITLES_PASS", ""))
+    parser.add_argument("--refresh", action="store_true", help="search files that are already in the index")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING, format="%(message)s")
+    engine_kwargs = {}
+    for engine_name in args.engines.split(","):
+        if engine_name not in ENGINE_NAMES:
+            parser.error(f"unknown engine: {engine_name}")
+        if engine_name == "OpenSubtitles":
+            if not (args.os_user and args.os_pass):
+                print("OpenSubtitles username or password is empty, skipped.", file=sys.stderr)
+                continue
+            engine_kwargs[engine_name] = dict(username=args.os_user, password=args.os_pass)
+        else:
+            engine_kwargs[engine_name] = {}
+
+    found = search_library(
+        args.paths, [language_id for language_id in args.languages.split(",") if language_id], engine_kwargs,
+        max_workers=args.workers, rate=args.rate, hash_workers=args.hash_workers, refresh=args.refresh
+    )
+    for file_path, count in sorted(found.items()):
+        print(f"{count:4d}  {file_path}")
+    with_subtitles = sum(1 for count in found.values() if count)
+    print(f"{len(found)} files searched, {with_subtitles} with subtitles.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
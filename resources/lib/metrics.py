@@ -0,0 +1,76 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+from .storage import JSONStore
+from .utils import get_setting
+
+
+class Metrics(JSONStore):
+    def __init__(self, enabled=True, max_entries=100):
+        super().__init__("metrics.json", max_entries=max_entries)
+        self.enabled = enabled
+        self.start = time.time()
+        self.spans = []
+        self.counters = {}
+
+    @staticmethod
+    def get_key(name, tags):
+        return name + "".join(f"|{key}={value}" for key, value in sorted(tags.items()))
+
+    @contextmanager
+    def span(self, name, **tags):
+        if not self.enabled:
+            yield
+            return
+
+        start = time.time()
+        error = None
+        try:
+            yield
+        except BaseException as ex:
+            error = ex.__class__.__name__
+            raise
+        finally:
+            span = dict(
+                name=name, start=round(start - self.start, 6), duration=round(time.time() - start, 6),
+                thread=threading.current_thread().name, **tags
+            )
+            if error:
+                span["error"] = error
+            with self.lock:
+                self.spans.append(span)
+
+    def count(self, name, value=1, **tags):
+        if not self.enabled:
+            return
+        key = self.get_key(name, tags)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def reset(self):
+        with self.lock:
+            self.start = time.time()
+            self.spans = []
+            self.counters = {}
+
+    def dump(self, action):
+        if not self.enabled:
+            return
+        # One entry per invocation, the oldest ones are dropped first
+        with self.lock:
+            self.set(f"{self.start:.6f}|{os.getpid()}", dict(
+                action=action, time=self.start, duration=round(time.time() - self.start, 6),
+                spans=list(self.spans), counters=dict(self.counters)
+            ))
+
+
+metrics = None
+
+
+def get_metrics():
+    global metrics
+    if metrics is None:
+        metrics = Metrics(enabled=get_setting("metrics", False), max_entries=get_setting("metrics_size", 100))
+    return metrics
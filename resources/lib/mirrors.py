@@ -0,0 +1,148 @@
+import time
+import socket
+import random
+from concurrent import futures
+
+from .storage import JSONStore
+from .utils import get_setting, log
+
+
+class MirrorScheduler(JSONStore):
+    def __init__(self, domains, port=80, probe_count=4, probe_timeout=3, exploration=0.1, cool_down=600):
+        super().__init__("mirrors.json")
+        self.domains = domains
+        self.port = port
+        self.probe_count = probe_count
+        self.probe_timeout = probe_timeout
+        self.exploration = exploration
+        self.cool_down = cool_down
+
+    def score(self, domain):
+        stats = self.data.get(domain)
+        if not stats:
+            return None
+        score = stats["latency"] * (1 + stats["errors"])
+        # Mirrors that failed recently go to the back of the line
+        if stats["errors"] >= 1 and time.time() - stats["last_error"] < self.cool_down:
+            score += self.cool_down
+        return score
+
+    def rank(self):
+        known = sorted((d for d in self.domains if self.score(d) is not None), key=self.score)
+        unknown = [d for d in self.domains if self.score(d) is None]
+        random.shuffle(unknown)
+        ranked = known + unknown
+        # Keep the scores of the other mirrors fresh
+        if known and random.random() < self.exploration:
+            ranked.insert(1, ranked.pop(random.randrange(len(ranked))))
+        return ranked
+
+    def report(self, domain, latency=None, error=False):
+        with self.lock:
+            stats = self.data.get(domain) or dict(latency=latency or self.probe_timeout, errors=0, last_error=0)
+            if error:
+                stats["errors"] += 1
+                stats["last_error"] = time.time()
+            else:
+                # Exponentially weighted latency, errors decay with every success
+                stats["latency"] = 0.7 * stats["latency"] + 0.3 * latency
+                stats["errors"] = stats["errors"] / 2
+            self.set(domain, stats)
+
+    def probe(self, domain):
+        start = time.time()
+        try:
+            socket.create_connection((domain, self.port), timeout=self.probe_timeout).close()
+        except OSError as ex:
+            self.report(domain, error=True)
+            raise Exception(f"{domain}: {ex}")
+        latency = time.time() - start
+        self.report(domain, latency=latency)
+        return domain, latency
+
+    def select(self, exclude=()):
+        candidates = [d for d in self.rank() if d not in exclude][:self.probe_count]
+        if not candidates:
+            return None
+
+        executor = futures.ThreadPoolExecutor(max_workers=len(candidates))
+        try:
+            probes = [executor.submit(self.probe, domain) for domain in candidates]
+            for probe in futures.as_completed(probes, timeout=self.probe_timeout * 2):
+                try:
+                    domain, latency = probe.result()
+                except Exception as ex:
+                    log("MirrorScheduler.select", f"Probe Failed: {ex}.")
+                    continue
+                log("MirrorScheduler.select", f"Selected Mirror: {domain} ({latency * 1000:.0f}ms).")
+                return domain
+        except futures.TimeoutError:
+            log("MirrorScheduler.select", "Probes Timed Out.")
+        finally:
+            # Slower probes finish in the background and still update the scores
+            executor.shutdown(wait=False)
+        return None
+
+
+class HedgePolicy(JSONStore):
+    def __init__(self, percentile=90, max_ratio=0.1, max_samples=100, min_samples=10):
+        super().__init__("hedging.json")
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.max_samples = max_samples
+        self.min_samples = min_samples
+
+    def get_delay(self):
+        latencies = sorted(self.data.get("latencies", []))
+        if len(latencies) < self.min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, len(latencies) * self.percentile // 100)]
+
+    def record(self, latency):
+        with self.lock:
+            latencies = self.data.get("latencies", [])[-(self.max_samples - 1):]
+            self.set("latencies", latencies + [latency])
+
+    def allow(self):
+        # Cap hedges to a fraction of all requests so server load stays bounded
+        return self.data.get("hedges", 0) < self.max_ratio * self.data.get("requests", 0)
+
+    def count(self, name):
+        with self.lock:
+            self.set(name, self.data.get(name, 0) + 1, save=False)
+            # Decay the counters so the cap follows recent traffic
+            if self.data.get("requests", 0) > 1000:
+                self.set("requests", self.data["requests"] // 2, save=False)
+                self.set("hedges", self.data.get("hedges", 0) // 2, save=False)
+            self.save()
+
+    def count_request(self):
+        self.count("requests")
+
+    def count_hedge(self):
+        self.count("hedges")
+
+
+mirror_schedulers = {}
+hedge_policy = None
+
+
+def get_mirror_scheduler(domains):
+    key = tuple(domains)
+    if key not in mirror_schedulers:
+        mirror_schedulers[key] = MirrorScheduler(
+            domains,
+            probe_count=get_setting("mirror_probe_count", 4),
+            probe_timeout=get_setting("mirror_probe_timeout", 3)
+        )
+    return mirror_schedulers[key]
+
+
+def get_hedge_policy():
+    global hedge_policy
+    if hedge_policy is None:
+        hedge_policy = HedgePolicy(
+            percentile=get_setting("hedge_percentile", 90),
+            max_ratio=get_setting("hedge_max_ratio", 10) / 100
+        )
+    return hedge_policy
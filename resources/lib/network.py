@@ -0,0 +1,202 @@
+import io
+import threading
+from urllib import request
+from http.cookiejar import CookieJar
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+
+
+# Compressed API responses are never expanded past this size
+MAX_DECODED_SIZE = 32 * 1024 * 1024
+READ_CHUNK_SIZE = 16384
+
+
+class HTTP10Connection(HTTPConnection):
+    _http_vsn = 10
+    _http_vsn_str = "HTTP/1.0"
+
+
+class HTTP10Handler(request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(HTTP10Connection, req)
+
+
+class ConnectionPool(object):
+    def __init__(self, max_idle_per_host=4):
+        self.max_idle_per_host = max_idle_per_host
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def acquire(self, connection_class, host, timeout):
+        key = (connection_class, host)
+        with self.lock:
+            connections = self.idle.get(key, [])
+            connection = connections.pop() if connections else None
+        if connection is None:
+            return key, connection_class(host, timeout=timeout), False
+        connection.timeout = timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(timeout)
+        return key, connection, True
+
+    def release(self, key, connection):
+        with self.lock:
+            connections = self.idle.setdefault(key, [])
+            if len(connections) < self.max_idle_per_host:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def clear(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+connection_pool = ConnectionPool()
+
+
+class PooledResponse(io.RawIOBase):
+    def __init__(self, pool, key, connection, res, max_decoded_size=MAX_DECODED_SIZE):
+        super(PooledResponse, self).__init__()
+        self.pool = pool
+        self.key = key
+        self.connection = connection
+        self.res = res
+        self.max_decoded_size = max_decoded_size
+        self.decoded_size = 0
+        self.pending = b""
+        self.decompressor = None
+        if res.msg.get("Content-Encoding", "").lower() == "gzip":
+            # zlib is only needed by servers that compress their responses
+            import zlib
+
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def readable(self):
+        return True
+
+    def release(self):
+        # The body was read to the end, the connection can serve the next request
+        connection, self.connection = self.connection, None
+        if self.res.will_close:
+            connection.close()
+        else:
+            self.pool.release(self.key, connection)
+
+    def read_decoded(self, size):
+        if self.decompressor is None:
+            data = self.res.read(size)
+            if not data:
+                self.release()
+            return data
+        if self.decompressor.unconsumed_tail:
+            data = self.decompressor.decompress(self.decompressor.unconsumed_tail, size)
+        else:
+            raw = self.res.read(READ_CHUNK_SIZE)
+            if raw:
+                data = self.decompressor.decompress(raw, size)
+            else:
+                data = self.decompressor.flush()
+                self.release()
+        self.decoded_size += len(data)
+        if self.decoded_size > self.max_decoded_size:
+            raise Exception(f"Response is bigger than the maximum size ({self.max_decoded_size} bytes).")
+        return data
+
+    def readinto(self, b):
+        try:
+            while not self.pending and self.connection is not None:
+                self.pending = self.read_decoded(len(b))
+        except Exception:
+            self.close()
+            raise
+        size = min(len(b), len(self.pending))
+        b[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+    def close(self):
+        # A body that was not read to the end leaves the connection in an unknown state
+        if self.connection is not None:
+            connection, self.connection = self.connection, None
+            connection.close()
+        self.res.close()
+        super(PooledResponse, self).close()
+
+
+class KeepAliveMixin(object):
+    connection_class = HTTPConnection
+
+    def __init__(self, pool=None, max_decoded_size=MAX_DECODED_SIZE, **kwargs):
+        super(KeepAliveMixin, self).__init__(**kwargs)
+        self.pool = pool or connection_pool
+        self.max_decoded_size = max_decoded_size
+
+    def send(self, req):
+        headers = dict(req.unredirected_hdrs)
+        headers.update({k: v for k, v in req.headers.items() if k not in headers})
+        headers = {k.title(): v for k, v in headers.items()}
+        headers.setdefault("Accept-Encoding", "gzip")
+
+        timeout = req.timeout if isinstance(req.timeout, (int, float)) else None
+        key, connection, reused = self.pool.acquire(self.connection_class, req.host, timeout)
+        try:
+            connection.request(req.get_method(), req.selector, req.data, headers)
+            res = connection.getresponse()
+        except (HTTPException, ConnectionError):
+            connection.close()
+            if not reused:
+                raise
+            # The server dropped an idle connection, retry once on a fresh one
+            key, connection, reused = self.pool.acquire(self.connection_class, req.host, timeout)
+            connection.request(req.get_method(), req.selector, req.data, headers)
+            res = connection.getresponse()
+        except Exception:
+            connection.close()
+            raise
+
+        # The body is streamed from the connection, which goes back to the pool once it was read to the end
+        body = PooledResponse(self.pool, key, connection, res, max_decoded_size=self.max_decoded_size)
+        wire_length = res.msg.get("Content-Length")
+        if body.decompressor is not None:
+            # The decoded length is unknown until the body is read
+            del res.msg["Content-Encoding"]
+            del res.msg["Content-Length"]
+
+        response = request.addinfourl(io.BufferedReader(body), res.msg, req.full_url, res.status)
+        response.msg = res.reason
+        response.wire_length = int(wire_length) if wire_length and wire_length.isdigit() else None
+        return response
+
+
+class KeepAliveHTTPHandler(KeepAliveMixin, request.HTTPHandler):
+    connection_class = HTTPConnection
+
+    def http_open(self, req):
+        return self.send(req)
+
+
+class KeepAliveHTTPSHandler(KeepAliveMixin, request.HTTPSHandler):
+    connection_class = HTTPSConnection
+
+    def https_open(self, req):
+        # Proxy tunnels are left to the default handler
+        if req._tunnel_host:
+            return super(KeepAliveHTTPSHandler, self).https_open(req)
+        return self.send(req)
+
+
+def get_session(proxies=None, cookies=True, http_10=False, keep_alive=True):
+    handlers = []
+    if proxies:
+        handlers.append(request.ProxyHandler(proxies))
+    if cookies:
+        cj = CookieJar()
+        handlers.append(request.HTTPCookieProcessor(cj))
+    if http_10:
+        handlers.append(HTTP10Handler)
+    elif keep_alive:
+        handlers.extend([KeepAliveHTTPHandler(), KeepAliveHTTPSHandler()])
+    return request.build_opener(*handlers)
@@ -0,0 +1,205 @@
+import json
+import time
+import threading
+from concurrent import futures
+
+import xbmc
+import xbmcgui
+
+from . import cache, metrics, mirrors, retry, scheduling
+from .codec import Subtitle
+from .cache import get_hash_cache
+from .metrics import get_metrics
+from .retry import Deadline, get_circuit_breaker
+from .scheduling import get_engine_scheduler
+from .ranking import rank_subtitles, select_best
+from .engines import ENGINE_NAMES, get_engine_kwargs, search_parts, download_subtitle
+from .utils import get_setting, get_video_paths, get_languages_dict, reload_settings, log
+
+HOME_WINDOW_ID = 10000
+PREWARM_PROPERTY = "service.subtitles.bsplayer.prewarm"
+PREWARM_POLL_INTERVAL = 0.1
+
+
+def get_subtitle_languages():
+    res = json.loads(xbmc.executeJSONRPC(json.dumps(dict(
+        jsonrpc="2.0", id=1, method="Settings.GetSettingValue", params=dict(setting="subtitles.languages")
+    ))))
+    languages = (res.get("result") or {}).get("value") or []
+    return [language_id for language_id in get_languages_dict(",".join(languages)) if language_id]
+
+
+def read_prewarmed():
+    value = xbmcgui.Window(HOME_WINDOW_ID).getProperty(PREWARM_PROPERTY)
+    try:
+        return json.loads(value) if value else None
+    except ValueError:
+        return None
+
+
+def write_prewarmed(entry):
+    xbmcgui.Window(HOME_WINDOW_ID).setProperty(PREWARM_PROPERTY, json.dumps(entry))
+
+
+def get_prewarmed(video_paths, language_ids, wait=0):
+    # Searches still running in the service are waited for, up to the engine time budget
+    expires = time.time() + wait
+    monitor = xbmc.Monitor()
+    while True:
+        entry = read_prewarmed()
+        if not entry or entry["paths"] != video_paths or not set(language_ids) <= set(entry["languages"]):
+            return {}
+        if not entry["pending"] or time.time() >= expires or monitor.waitForAbort(PREWARM_POLL_INTERVAL):
+            break
+
+    if time.time() - entry["time"] > get_setting("result_cache_ttl", 60) * 60:
+        return {}
+    subtitles = {}
+    for engine_name, parts in entry["results"].items():
+        subtitles[engine_name] = [
+            [
+                Subtitle(**subtitle) for subtitle in part
+                if set(language_ids) == set(entry["languages"]) or subtitle["subLang"] in language_ids
+            ] for part in parts
+        ]
+    return subtitles
+
+
+def reset_singletons():
+    # Every getter builds its object from the settings again on the next call
+    cache.rar_index_cache = cache.hash_cache = cache.result_cache = None
+    cache.token_cache = cache.subtitle_store = None
+    retry.retry_policy = retry.circuit_breaker = None
+    mirrors.hedge_policy = None
+    mirrors.mirror_schedulers.clear()
+    scheduling.engine_scheduler = None
+    metrics.metrics = None
+
+
+def select_subtitles(player, found, video_path, language_ids, is_playing=None):
+    # Languages the video already has a subtitle stream for are never replaced, nor are the ones after them
+    streams = {xbmc.convertLanguage(stream, xbmc.ISO_639_2) for stream in player.getAvailableSubtitleStreams()}
+    selected_language_ids = []
+    for language_id in language_ids:
+        if language_id in streams:
+            break
+        selected_language_ids.append(language_id)
+
+    selected = select_best(rank_subtitles(found, video_path, selected_language_ids), selected_language_ids)
+    # The first language is set last, it ends up as the active subtitle
+    for engine_name, subtitle in reversed(selected):
+        subtitle_path = download_subtitle(engine_name, subtitle["subDownloadLink"], subtitle["subName"])
+        if is_playing and not is_playing():
+            return
+        if subtitle_path:
+            log("Prewarm.select_subtitles", f"Selected {engine_name} Subtitle: {subtitle['subName']}.")
+            player.setSubtitles(subtitle_path)
+
+
+class SettingsMonitor(xbmc.Monitor):
+    def onSettingsChanged(self):
+        log("SettingsMonitor.onSettingsChanged", "Reloading Settings.")
+        reload_settings()
+        reset_singletons()
+
+
+class Prewarmer(xbmc.Player):
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.playing = None
+
+    def onAVStarted(self):
+        if not (get_setting("prewarm", False) or get_setting("auto_select", False)) or not self.isPlayingVideo():
+            return
+        # Callbacks are not blocked while the engines search
+        threading.Thread(target=self.prewarm, daemon=True).start()
+
+    def onPlayBackStopped(self):
+        with self.lock:
+            self.playing = None
+
+    def onPlayBackEnded(self):
+        self.onPlayBackStopped()
+
+    def publish(self, entry, engine_name=None, parts=None):
+        with self.lock:
+            # A newer video has started, its entry must not be overwritten
+            if self.playing is not entry:
+                return
+            if engine_name:
+                entry["results"][engine_name] = [[dict(subtitle) for subtitle in part] for part in parts]
+            write_prewarmed(entry)
+
+    @staticmethod
+    def search_engine(engine_name, video_paths, language_ids):
+        deadline = Deadline(get_setting("engine_timeout", 10))
+        with get_metrics().span("engine", engine=engine_name):
+            return search_parts(engine_name, video_paths, language_ids, deadline=deadline)
+
+    def auto_select(self, entry):
+        # Playback starts with the first part of a stack
+        found = [
+            (engine_name, Subtitle(**subtitle)) for engine_name in ENGINE_NAMES if engine_name in entry["results"]
+            for subtitle in entry["results"][engine_name][0]
+        ]
+
+        def is_playing():
+            with self.lock:
+                return self.playing is entry
+
+        select_subtitles(self, found, entry["paths"][0], entry["languages"], is_playing=is_playing)
+
+    def prewarm(self):
+        try:
+            video_paths = get_video_paths()
+            language_ids = get_subtitle_languages()
+        except Exception as ex:
+            log("Prewarmer.prewarm", f"ERROR: {ex}.")
+            return
+        log("Prewarmer.prewarm", f"Searching {video_paths} In Background, Languages: {language_ids}.")
+        # Every playback is a new run, streams are checked for changes again
+        get_hash_cache().reset_remote()
+
+        engine_names = [
+            engine_name for engine_name in ENGINE_NAMES
+            if all(get_engine_kwargs(engine_name).values()) and get_circuit_breaker().allow(engine_name)
+        ]
+        engine_scheduler = get_engine_scheduler()
+        if engine_scheduler is not None:
+            engine_names = engine_scheduler.schedule(engine_names, language_ids)
+        entry = dict(paths=video_paths, languages=language_ids, time=time.time(), pending=True, results={})
+        with self.lock:
+            self.playing = entry
+        self.publish(entry)
+
+        engine_timeout = get_setting("engine_timeout", 10)
+        executor = futures.ThreadPoolExecutor(max_workers=len(engine_names) or 1)
+        try:
+            pending = {
+                executor.submit(self.search_engine, engine_name, video_paths, language_ids): engine_name
+                for engine_name in engine_names
+            }
+            try:
+                for future in futures.as_completed(pending, timeout=engine_timeout or None):
+                    engine_name = pending.pop(future)
+                    try:
+                        self.publish(entry, engine_name, future.result())
+                    except Exception as ex:
+                        log("Prewarmer.prewarm", f"{engine_name} Error: {ex}.")
+            except futures.TimeoutError:
+                log("Prewarmer.prewarm", f"Timeout ({engine_timeout}s) Exceeded By: {', '.join(pending.values())}.")
+        finally:
+            # Do not wait for engines that exceeded their time budget
+            executor.shutdown(wait=False)
+            # The dialog stops waiting for this entry even if the search failed
+            entry["pending"] = False
+            self.publish(entry)
+        log("Prewarmer.prewarm", f"Done, Results From: {', '.join(entry['results'])}.")
+        if get_setting("auto_select", False):
+            self.auto_select(entry)
+
+        # The service keeps running, every playback is recorded on its own
+        metrics = get_metrics()
+        metrics.dump("prewarm")
+        metrics.reset()
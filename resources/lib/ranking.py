@@ -0,0 +1,85 @@
+import re
+from os import path
+from urllib import parse
+
+from .utils import is_remote_path, VIDEO_EXTENSIONS
+
+SUBTITLE_FORMATS = ["srt", "sub", "txt", "smi", "ssa", "ass"]
+TOKEN_PATTERN = re.compile(r"[^a-z0-9]+")
+# Release name similarity outweighs the rating, a matching release group outweighs a perfect rating
+MATCH_WEIGHT = 10.0
+GROUP_WEIGHT = 5.0
+RATING_WEIGHT = 0.5
+# Names sharing this much of their tokens are the same file, "720p" against "1080p" alone drops below it
+DUPLICATE_SIMILARITY = 0.8
+
+
+def get_release_tokens(file_path):
+    if is_remote_path(file_path):
+        file_path = parse.unquote(parse.urlparse(file_path).path)
+    name, ext = path.splitext(path.basename(file_path.rstrip("/\\")))
+    # "Movie.2020.720p" has no extension to drop
+    if ext.lower() not in VIDEO_EXTENSIONS and ext[1:].lower() not in SUBTITLE_FORMATS:
+        name += ext
+    return [token for token in TOKEN_PATTERN.split(name.lower()) if token]
+
+
+def get_similarity(tokens, other_tokens):
+    return len(tokens & other_tokens) / len(tokens | other_tokens)
+
+
+def get_score(subtitle, tokens, video_tokens):
+    score = float(subtitle["subRating"] or 0) * RATING_WEIGHT
+    if tokens and video_tokens:
+        score += MATCH_WEIGHT * get_similarity(set(tokens), set(video_tokens))
+        # The release group is the last token of a scene name
+        if tokens[-1] == video_tokens[-1]:
+            score += GROUP_WEIGHT
+    return score
+
+
+def score_subtitles(found, video_tokens):
+    scored = []
+    for engine_name, subtitle in found:
+        tokens = get_release_tokens(subtitle["subName"] or "")
+        scored.append((get_score(subtitle, tokens, video_tokens), engine_name, subtitle, set(tokens)))
+    return scored
+
+
+def merge_subtitles(scored, language_ids):
+    language_order = {language_id: i for i, language_id in enumerate(language_ids)}
+    ranked = sorted(scored, key=lambda r: (language_order.get(r[2]["subLang"], len(language_order)), -r[0]))
+
+    merged = []
+    kept = {}
+    ids = set()
+    for score, engine_name, subtitle, tokens in ranked:
+        # The same file listed by several providers is kept once, from the provider that scored it best,
+        # names only differing by punctuation or an extra tag or two are the same file
+        id_key = (engine_name, subtitle["subID"])
+        if id_key in ids:
+            continue
+        names = kept.setdefault((subtitle["subLang"], subtitle["subFormat"]), [])
+        if tokens and any(
+            other_engine_name != engine_name and get_similarity(tokens, other_tokens) >= DUPLICATE_SIMILARITY
+            for other_engine_name, other_tokens in names
+        ):
+            continue
+        if tokens:
+            names.append((engine_name, tokens))
+        ids.add(id_key)
+        merged.append((engine_name, subtitle, score))
+    return merged
+
+
+def rank_subtitles(found, video_path, language_ids):
+    return merge_subtitles(score_subtitles(found, get_release_tokens(video_path)), language_ids)
+
+
+def select_best(merged, language_ids):
+    best = {}
+    for engine_name, subtitle, score in merged:
+        language_id = subtitle["subLang"]
+        if language_id in language_ids and language_id not in best and subtitle["subFormat"] in SUBTITLE_FORMATS:
+            best[language_id] = (engine_name, subtitle)
+    return [best[language_id] for language_id in language_ids if language_id in best]
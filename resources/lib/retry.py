@@ -0,0 +1,134 @@
+import time
+import random
+from http.client import HTTPException
+from xml.etree.ElementTree import ParseError
+from urllib.error import HTTPError
+
+from .storage import JSONStore
+from .metrics import get_metrics
+from .utils import get_setting, log
+
+
+class RetriesExhausted(Exception):
+    pass
+
+
+class DeadlineExceeded(RetriesExhausted):
+    pass
+
+
+class Deadline(object):
+    def __init__(self, timeout=None):
+        self.expires = time.time() + timeout if timeout else None
+
+    def remaining(self):
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.time())
+
+    def expired(self):
+        return self.expires is not None and time.time() >= self.expires
+
+    def get_timeout(self, timeout):
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        return min(timeout, remaining) if timeout else remaining
+
+
+def is_retryable(ex):
+    if isinstance(ex, HTTPError):
+        # Client errors will fail the same way again, except timeouts and rate limits
+        return ex.code >= 500 or ex.code in (408, 429)
+    return isinstance(ex, (OSError, HTTPException, ParseError))
+
+
+class RetryPolicy(object):
+    def __init__(self, tries=5, attempt_timeout=10, base_delay=0.5, max_delay=8, jitter=0.5):
+        self.tries = tries
+        self.attempt_timeout = attempt_timeout
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def get_delay(self, attempt):
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay * (1 - self.jitter * random.random())
+
+    def call(self, func, deadline=None, on_error=None, name="RetryPolicy.call", tries=None):
+        deadline = deadline or Deadline()
+        tries = tries or self.tries
+        for attempt in range(tries):
+            if deadline.expired():
+                log(name, "ERROR: Deadline exceeded.")
+                raise DeadlineExceeded("Deadline exceeded...")
+            try:
+                return func(deadline.get_timeout(self.attempt_timeout))
+            except Exception as ex:
+                log(name, f"ERROR: {ex}.")
+                if not is_retryable(ex):
+                    raise
+                if on_error:
+                    on_error(ex)
+                if attempt == tries - 1:
+                    break
+                get_metrics().count("retries", source=name)
+                delay = self.get_delay(attempt)
+                remaining = deadline.remaining()
+                if remaining is not None and delay >= remaining:
+                    log(name, "ERROR: Deadline exceeded.")
+                    raise DeadlineExceeded("Deadline exceeded...")
+                time.sleep(delay)
+        log(name, f"ERROR: Too many tries ({tries})...")
+        raise RetriesExhausted("Too many tries...")
+
+
+class CircuitBreaker(JSONStore):
+    def __init__(self, threshold=3, cool_down=300):
+        super().__init__("breakers.json")
+        self.threshold = threshold
+        self.cool_down = cool_down
+
+    def allow(self, name):
+        state = self.data.get(name)
+        if not state or state["failures"] < self.threshold:
+            return True
+        # Half open, a single attempt is let through once the cool-down expires
+        return time.time() >= state["open_until"]
+
+    def record_success(self, name):
+        if name in self.data:
+            self.pop(name)
+
+    def record_failure(self, name):
+        with self.lock:
+            state = self.data.get(name) or dict(failures=0, open_until=0)
+            state["failures"] += 1
+            if state["failures"] >= self.threshold:
+                state["open_until"] = time.time() + self.cool_down
+                log("CircuitBreaker.record_failure", f"{name} Disabled For {self.cool_down}s.")
+            self.set(name, state)
+
+
+retry_policy = None
+circuit_breaker = None
+
+
+def get_retry_policy():
+    global retry_policy
+    if retry_policy is None:
+        retry_policy = RetryPolicy(
+            tries=get_setting("retry_tries", 5),
+            attempt_timeout=get_setting("retry_attempt_timeout", 10)
+        )
+    return retry_policy
+
+
+def get_circuit_breaker():
+    global circuit_breaker
+    if circuit_breaker is None:
+        circuit_breaker = CircuitBreaker(
+            threshold=get_setting("breaker_threshold", 3),
+            cool_down=get_setting("breaker_cool_down", 5) * 60
+        )
+    return circuit_breaker
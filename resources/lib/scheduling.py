@@ -0,0 +1,91 @@
+import time
+import random
+
+from .storage import JSONStore
+from .utils import get_setting, get_language_id, log
+
+
+class EngineScheduler(JSONStore):
+    def __init__(self, min_hit_rate=0.05, min_samples=10, exploration=0.1):
+        super().__init__("engines.json")
+        self.min_hit_rate = min_hit_rate
+        self.min_samples = min_samples
+        self.exploration = exploration
+
+    @staticmethod
+    def get_key(engine_name, language_id):
+        return f"{engine_name}|{language_id}"
+
+    def get_hit_rate(self, engine_name, language_ids):
+        # Chance that at least one language is found, None until every language has enough samples
+        miss_rate = 1.0
+        for language_id in language_ids:
+            stats = self.data.get(self.get_key(engine_name, language_id))
+            if not stats or stats["samples"] < self.min_samples:
+                return None
+            miss_rate *= 1 - stats["hit_rate"]
+        return 1 - miss_rate
+
+    def get_latency(self, engine_name, language_ids):
+        latencies = []
+        for language_id in language_ids:
+            stats = self.data.get(self.get_key(engine_name, language_id))
+            if stats:
+                latencies.append(stats["latency"])
+        return sum(latencies) / len(latencies) if latencies else 0.0
+
+    def score(self, engine_name, language_ids):
+        hit_rate = self.get_hit_rate(engine_name, language_ids)
+        if hit_rate is None:
+            return None
+        # Subtitles found per second spent waiting
+        return hit_rate / max(self.get_latency(engine_name, language_ids), 0.01)
+
+    def schedule(self, engine_names, language_ids):
+        scores = {engine_name: self.score(engine_name, language_ids) for engine_name in engine_names}
+        # Engines still learning go first, the rest from the most to the least useful
+        ranked = sorted(engine_names, key=lambda e: (scores[e] is not None, -(scores[e] or 0)))
+        scheduled = []
+        for engine_name in ranked:
+            hit_rate = self.get_hit_rate(engine_name, language_ids)
+            if hit_rate is not None and hit_rate < self.min_hit_rate:
+                # Keep the stats of skipped engines fresh
+                if random.random() >= self.exploration:
+                    log("EngineScheduler.schedule", f"{engine_name} Skipped, Hit Rate: {hit_rate:.0%}.")
+                    continue
+                log("EngineScheduler.schedule", f"{engine_name} Explored, Hit Rate: {hit_rate:.0%}.")
+            scheduled.append(engine_name)
+        # An empty dialog is never shown without asking at least the most useful engine
+        return scheduled or ranked[:1]
+
+    def record(self, engine_name, language_ids, parts, latency):
+        codes = {subtitle["subLang"] for subtitles in parts for subtitle in subtitles}
+        # Codes that do not map back to a searched language count as a miss
+        found = {code if code in language_ids else get_language_id(code) for code in codes}
+        with self.lock:
+            for language_id in language_ids:
+                key = self.get_key(engine_name, language_id)
+                hit = 1.0 if language_id in found else 0.0
+                stats = self.data.get(key) or dict(hit_rate=hit, latency=latency, samples=0)
+                # Exponentially weighted, recent searches count the most
+                stats["hit_rate"] = 0.8 * stats["hit_rate"] + 0.2 * hit
+                stats["latency"] = 0.7 * stats["latency"] + 0.3 * latency
+                stats["samples"] += 1
+                stats["time"] = time.time()
+                self.set(key, stats, save=False)
+            self.save()
+
+
+engine_scheduler = None
+
+
+def get_engine_scheduler():
+    global engine_scheduler
+    if not get_setting("adaptive_engines", True):
+        return None
+    if engine_scheduler is None:
+        engine_scheduler = EngineScheduler(
+            min_hit_rate=get_setting("adaptive_min_hit_rate", 5) / 100,
+            exploration=get_setting("adaptive_exploration", 10) / 100
+        )
+    return engine_scheduler
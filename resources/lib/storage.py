@@ -0,0 +1,148 @@
+import json
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from os import path, makedirs, replace, remove, fdopen, stat
+from os import open as os_open, close, O_CREAT, O_EXCL, O_WRONLY
+
+from .utils import PROFILE_PATH, log
+
+# Plugin invocations and the prewarm service share the profile, saves are serialized through a lock file
+LOCK_TIMEOUT = 2.0
+LOCK_STALE = 10.0
+LOCK_POLL_INTERVAL = 0.01
+
+
+@contextmanager
+def file_lock(file_path):
+    lock_path = file_path + ".lock"
+    deadline = time.time() + LOCK_TIMEOUT
+    fd = None
+    while fd is None:
+        try:
+            fd = os_open(lock_path, O_CREAT | O_EXCL | O_WRONLY)
+        except FileExistsError:
+            try:
+                # A process killed while saving leaves its lock behind
+                if time.time() - path.getmtime(lock_path) > LOCK_STALE:
+                    remove(lock_path)
+                    continue
+            except OSError:
+                continue
+            if time.time() >= deadline:
+                log("JSONStore.file_lock", f"Lock Timeout, Saving {path.basename(file_path)} Unlocked.")
+                break
+            time.sleep(LOCK_POLL_INTERVAL)
+    try:
+        yield
+    finally:
+        if fd is not None:
+            close(fd)
+            remove(lock_path)
+
+
+class JSONStore(object):
+    def __init__(self, name, max_entries=0):
+        self.file_path = path.join(PROFILE_PATH, name)
+        self.max_entries = max_entries
+        self.lock = threading.RLock()
+        self._data = None
+        self.version = None
+        # Keys set or popped since the last save, and keys only read, which move to the back of the LRU order
+        self.changed = set()
+        self.touched = set()
+
+    def get_version(self):
+        try:
+            st = stat(self.file_path)
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+
+    @property
+    def data(self):
+        with self.lock:
+            # Other processes write the same file, their entries are picked up as soon as it changes
+            version = self.get_version()
+            if self._data is None or version != self.version:
+                self._data = self.merge(self.load())
+                self.version = version
+            return self._data
+
+    def load(self):
+        try:
+            with open(self.file_path, "r", encoding="utf-8") as f:
+                return OrderedDict(json.load(f, object_pairs_hook=OrderedDict))
+        except FileNotFoundError:
+            pass
+        except Exception as ex:
+            log("JSONStore.load", f"ERROR: Loading {path.basename(self.file_path)}: {ex}.")
+        return OrderedDict()
+
+    def merge(self, data):
+        # Changes not saved yet are applied over what is on disk, every other entry is taken from disk
+        local = self._data or {}
+        for key in self.changed:
+            if key in local:
+                data[key] = local[key]
+                data.move_to_end(key)
+            else:
+                data.pop(key, None)
+        for key in self.touched - self.changed:
+            if key in data:
+                data.move_to_end(key)
+        while self.max_entries and len(data) > self.max_entries:
+            data.popitem(last=False)
+        return data
+
+    def save(self):
+        from tempfile import mkstemp
+
+        with self.lock:
+            directory = path.dirname(self.file_path)
+            makedirs(directory, exist_ok=True)
+            with file_lock(self.file_path):
+                # Never written from a stale copy, the file is read again under the lock
+                data = self.merge(self.load())
+                fd, temp_path = mkstemp(dir=directory, suffix=".tmp")
+                try:
+                    with fdopen(fd, "w", encoding="utf-8") as f:
+                        json.dump(data, f)
+                    replace(temp_path, self.file_path)
+                except Exception as ex:
+                    log("JSONStore.save", f"ERROR: Saving {path.basename(self.file_path)}: {ex}.")
+                    if path.exists(temp_path):
+                        remove(temp_path)
+                    return
+                self._data = data
+                self.version = self.get_version()
+                self.changed = set()
+                self.touched = set()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.data:
+                return default
+            # Least recently used entries are kept at the front
+            self.data.move_to_end(key)
+            self.touched.add(key)
+            return self.data[key]
+
+    def set(self, key, value, save=True):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            self.changed.add(key)
+            while self.max_entries and len(self.data) > self.max_entries:
+                self.data.popitem(last=False)
+            if save:
+                self.save()
+
+    def pop(self, key, default=None, save=True):
+        with self.lock:
+            value = self.data.pop(key, default)
+            self.changed.add(key)
+            if save:
+                self.save()
+            return value
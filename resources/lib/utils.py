@@ -1,17 +1,22 @@
 import io
 import sys
 import struct
-from os import path
-from urllib import parse, request
-from http.cookiejar import CookieJar
-from http.client import HTTPConnection
+from os import path, stat, environ, fdopen, replace, remove
+from urllib import parse
 
 try:
     import xbmc
     import xbmcvfs
+    import xbmcaddon
 
     logger = xbmc.log
     LOG_LEVEL = xbmc.LOGDEBUG
+    addon = xbmcaddon.Addon("service.subtitles.bsplayer")
+    PROFILE_PATH = xbmcvfs.translatePath(addon.getAddonInfo("profile"))
+
+
+    def is_debug_logging():
+        return xbmc.getCondVisibility("System.GetBool(debug.showloginfo)")
 
 
     class file(xbmcvfs.File):
@@ -29,10 +34,46 @@ except ModuleNotFoundError:
 
     logger = logging.getLogger(__name__).log
     LOG_LEVEL = logging.DEBUG
+    addon = None
+    PROFILE_PATH = environ.get("BSPLAYER_PROFILE", path.join(path.expanduser("~"), ".service.subtitles.bsplayer"))
     file = open
 
 
+    def is_debug_logging():
+        return logging.getLogger(__name__).isEnabledFor(LOG_LEVEL)
+
+# Imported on first hash, numpy is slow to import on low end boxes
+numpy = None
+
+HASH_CHUNK_SIZE = 65536
+STREAM_CHUNK_SIZE = 16384
+HASH_MASK = 0xFFFFFFFFFFFFFFFF
+# 8192 little-endian long longs per 64 KiB window, unpacked in a single call
+HASH_CHUNK_STRUCT = struct.Struct("<%dq" % (HASH_CHUNK_SIZE // 8))
+RAR5_SIGNATURE = b"Rar!\x1a\x07\x01\x00"
+RAR_HEADER_WINDOW = 4096
+# Enough bytes to parse the fixed fields of any RAR4 or RAR5 header
+RAR_HEADER_MAX = 64
+RAR_MAX_HEADERS = 16
+VIDEO_EXTENSIONS = (
+    ".avi", ".divx", ".m2ts", ".m4v", ".mkv", ".mov", ".mp4", ".mpeg", ".mpg", ".ogm", ".ts", ".vob", ".wmv", ".rar"
+)
+REMOTE_SCHEMES = ("http://", "https://")
+REMOTE_TIMEOUT = 10
+
+
+debug_logging = None
+
+
 def log(module, msg):
+    global debug_logging
+    # Expensive messages are passed as callables and only built when debug logging is on
+    if callable(msg):
+        if debug_logging is None:
+            debug_logging = bool(is_debug_logging())
+        if not debug_logging:
+            return
+        msg = msg()
     logger(msg=f"### [BSPlayer::{module}] - {msg}", level=LOG_LEVEL)
 
 
@@ -40,19 +81,71 @@ def notify(script_name, language, string_id):
     xbmc.executebuiltin(f"Notification({script_name}, {language(string_id)})")
 
 
+def reload_settings():
+    # An Addon keeps the settings it was created with, a long running service needs a new one to see changes
+    global addon, debug_logging
+    if addon is not None:
+        addon = xbmcaddon.Addon("service.subtitles.bsplayer")
+    debug_logging = None
+
+
+def get_setting(setting_id, default=""):
+    value = addon.getSetting(setting_id) if addon else ""
+    if value == "":
+        return default
+    if isinstance(default, bool):
+        return value.lower() == "true"
+    if isinstance(default, int):
+        return int(float(value))
+    if isinstance(default, float):
+        return float(value)
+    return value
+
+
+def get_file_stat(file_path):
+    if addon is None or path.exists(file_path):
+        st = stat(file_path)
+        return st.st_size, int(st.st_mtime)
+    st = xbmcvfs.Stat(file_path)
+    return st.st_size(), st.st_mtime()
+
+
+def is_remote_path(file_path):
+    return file_path.startswith(REMOTE_SCHEMES)
+
+
+def split_url_headers(url):
+    # Kodi appends the stream request headers to the url: http://host/movie.mkv|User-Agent=...&Referer=...
+    url, _, headers = url.partition("|")
+    return url, dict(parse.parse_qsl(headers))
+
+
 def get_params(params_str=""):
     params_str = params_str or sys.argv[2]
     return dict(parse.parse_qsl(params_str.lstrip("?")))
 
 
-def get_video_path(xbmc_path=""):
-    xbmc_path = xbmc_path or parse.unquote(xbmc.Player().getPlayingFile())
-    if xbmc_path.startswith("rar://"):
-        return path.dirname(xbmc_path.replace("rar://", ""))
-    elif xbmc_path.startswith("stack://"):
-        return xbmc_path.split(" , ")[0].replace("stack://", "")
+def get_video_paths(xbmc_path=""):
+    if not xbmc_path:
+        xbmc_path = xbmc.Player().getPlayingFile()
+        # Stream urls are requested as they are, unquoting would break them
+        if not is_remote_path(xbmc_path):
+            xbmc_path = parse.unquote(xbmc_path)
+    # stack://part1 , part2 , ... commas inside the part paths are doubled
+    parts = [xbmc_path]
+    if xbmc_path.startswith("stack://"):
+        parts = [part.replace(",,", ",") for part in xbmc_path.replace("stack://", "", 1).split(" , ")]
+
+    video_paths = []
+    for part in parts:
+        if part.startswith("rar://"):
+            part = path.dirname(part.replace("rar://", ""))
+        video_paths.append(part)
+    return video_paths
+
 
-    return xbmc_path
+def get_video_path(xbmc_path=""):
+    return get_video_paths(xbmc_path)[0]
 
 
 def get_languages_dict(languages_param):
@@ -67,26 +160,54 @@ def get_languages_dict(languages_param):
     return langs
 
 
-class HTTP10Connection(HTTPConnection):
-    _http_vsn = 10
-    _http_vsn_str = "HTTP/1.0"
+def get_language_id(language):
+    # Engines report ISO 639-1 codes or English names as well, Kodi maps them to the ISO 639-2 ids searched
+    if addon is None or not language:
+        return language
+    return xbmc.convertLanguage(language, xbmc.ISO_639_2) or language
+
+
+def iter_gzip(fileobj, chunk_size=STREAM_CHUNK_SIZE):
+    # Decompression modules are only imported by the code paths that download subtitles
+    import gzip
+
+    with gzip.GzipFile(fileobj=fileobj) as gf:
+        for chunk in iter(lambda: gf.read(chunk_size), b""):
+            yield chunk
 
 
-class HTTP10Handler(request.HTTPHandler):
-    def http_open(self, req):
-        return self.do_open(HTTP10Connection, req)
+def iter_base64_zlib(text, chunk_size=STREAM_CHUNK_SIZE):
+    import zlib
+    import binascii
 
+    text = "".join(text.split())
+    decompressor = zlib.decompressobj()
+    # Base64 decodes in groups of 4 characters, keep slices aligned
+    for i in range(0, len(text), chunk_size * 4):
+        data = binascii.a2b_base64(text[i:i + chunk_size * 4])
+        while data:
+            yield decompressor.decompress(data, chunk_size)
+            data = decompressor.unconsumed_tail
+    yield decompressor.flush()
 
-def get_session(proxies=None, cookies=True, http_10=False):
-    handlers = []
-    if proxies:
-        handlers.append(request.ProxyHandler(proxies))
-    if cookies:
-        cj = CookieJar()
-        handlers.append(request.HTTPCookieProcessor(cj))
-    if http_10:
-        handlers.append(HTTP10Handler)
-    return request.build_opener(*handlers)
+
+def write_atomic(chunks, dest_path, max_size=0):
+    from tempfile import mkstemp
+
+    fd, temp_path = mkstemp(dir=path.dirname(dest_path) or ".", suffix=".part")
+    size = 0
+    try:
+        with fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                size += len(chunk)
+                if max_size and size > max_size:
+                    raise Exception(f"File is bigger than the maximum size ({max_size} bytes).")
+                f.write(chunk)
+        replace(temp_path, dest_path)
+    except Exception:
+        remove(temp_path)
+        raise
+    return size
 
 
 def __get_last_split(firs_rar_file, x):
@@ -99,81 +220,286 @@ def __get_last_split(firs_rar_file, x):
     return firs_rar_file[0:-2] + ("%02d" % (x - 1))
 
 
-def __add_file_hash(name, file_hash, seek):
-    f = file(name, "rb")
-    f.seek(max(0, seek), 0)
-    for i in range(8192):
-        file_hash += struct.unpack("<q", f.read(8))[0]
-        file_hash &= 0xffffffffffffffff
-    f.close()
-    return file_hash
+def get_numpy():
+    global numpy
+    if numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            numpy = False
+    return numpy
 
 
-def __movie_size_and_hash_rar(firs_rar_file):
-    log("utils.movie_size_and_hash", "Hashing Rar file...")
-    f = file(firs_rar_file, "rb")
-    a = f.read(4)
-    if a != b"Rar!":
-        log("utils.movie_size_and_hash", "ERROR: This is not rar file (%s)." % path.basename(firs_rar_file))
-        raise Exception("ERROR: This is not rar file.")
-    seek = 0
-    for i in range(4):
-        f.seek(max(0, seek), 0)
-        a = f.read(100)
+def __map_concurrently(func, items):
+    # concurrent.futures pulls in logging, it is only imported when hashing needs it
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=len(items)) as executor:
+        return list(executor.map(func, items))
+
+
+def __sum_chunk(data):
+    if len(data) != HASH_CHUNK_SIZE:
+        raise Exception(f"Short read ({len(data)} of {HASH_CHUNK_SIZE} bytes).")
+    if get_numpy():
+        return int(numpy.frombuffer(data, dtype="<u8").sum(dtype=numpy.uint64))
+    return sum(HASH_CHUNK_STRUCT.unpack(data)) & HASH_MASK
+
+
+def __read_chunk(file_path, offset):
+    f = file(file_path, "rb")
+    try:
+        f.seek(offset, 0)
+        data = b""
+        while len(data) < HASH_CHUNK_SIZE:
+            buff = f.read(HASH_CHUNK_SIZE - len(data))
+            if not buff:
+                break
+            data += bytes(buff)
+        return data
+    finally:
+        f.close()
+
+
+def __read_chunks(file_path, offsets):
+    # Local files are mapped, VFS paths (smb://, nfs://...) fetch all windows concurrently
+    if path.isfile(file_path):
+        import mmap
+
+        chunks = []
+        with open(file_path, "rb") as f:
+            file_size = path.getsize(file_path)
+            for offset in offsets:
+                # Only the window is mapped, a whole multi GiB file does not fit the address space of 32-bit boxes
+                start = offset - offset % mmap.ALLOCATIONGRANULARITY
+                length = min(offset + HASH_CHUNK_SIZE, file_size) - start
+                if length <= offset - start:
+                    chunks.append(b"")
+                    continue
+                with mmap.mmap(f.fileno(), length, access=mmap.ACCESS_READ, offset=start) as m:
+                    chunks.append(m[offset - start:])
+        return chunks
+    if len(offsets) == 1:
+        return [__read_chunk(file_path, offsets[0])]
+    return __map_concurrently(lambda offset: __read_chunk(file_path, offset), offsets)
+
+
+def __get_file_size(file_path):
+    f = file(file_path, "rb")
+    try:
+        return f.seek(0, io.SEEK_END)
+    finally:
+        f.close()
+
+
+def __read_vint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def __read_rar_header(f, seek, window):
+    # Headers are parsed out of one window, it is only re-read when a header crosses its end
+    window_offset, data = window
+    if seek < window_offset or seek + RAR_HEADER_MAX > window_offset + len(data):
+        f.seek(seek, 0)
+        window = (seek, bytes(f.read(RAR_HEADER_WINDOW)))
+        window_offset, data = window
+    return data[seek - window_offset:], window
+
+
+def __read_rar4_index(f):
+    seek, window = 0, (0, b"")
+    for i in range(RAR_MAX_HEADERS):
+        a, window = __read_rar_header(f, seek, window)
         tipe, flag, size = struct.unpack("<BHH", a[2:2 + 5])
         if 0x74 == tipe:
             if 0x30 != struct.unpack("<B", a[25:25 + 1])[0]:
                 log('utils.movie_size_and_hash', 'Bad compression method! Work only for "store".')
                 raise Exception('Bad compression method! Work only for "store".')
-            s_partiize_body_start = seek + size
             s_partiize_body, s_unpack_size = struct.unpack("<II", a[7:7 + 2 * 4])
             if flag & 0x0100:
                 s_unpack_size += (struct.unpack("<I", a[36:36 + 4])[0] << 32)
                 log("utils.movie_size_and_hash",
                     "WARNING: Hash untested for files biger that 2gb. May work or may generate bad hash.")
-            last_rar_file = __get_last_split(firs_rar_file, (s_unpack_size - 1) / s_partiize_body)
-            file_hash = __add_file_hash(firs_rar_file, s_unpack_size, s_partiize_body_start)
-            file_hash = __add_file_hash(
-                last_rar_file, file_hash, (s_unpack_size % s_partiize_body) + s_partiize_body_start - 65536
-            )
-            f.close()
-            return s_unpack_size, "%016x" % file_hash
+            return dict(unpack_size=s_unpack_size, packed_size=s_partiize_body, data_offset=seek + size)
+        if flag & 0x8000:
+            size += struct.unpack("<I", a[7:7 + 4])[0]
         seek += size
-    log("utils.movie_size_and_hash", "ERROR: Not Body part in rar file.")
-    raise Exception("ERROR: Not Body part in rar file.")
+    return None
+
+
+def __read_rar5_index(f):
+    seek, window = len(RAR5_SIGNATURE), (0, b"")
+    for i in range(RAR_MAX_HEADERS):
+        a, window = __read_rar_header(f, seek, window)
+        header_size, pos = __read_vint(a, 4)
+        header_end = pos + header_size
+        tipe, pos = __read_vint(a, pos)
+        flags, pos = __read_vint(a, pos)
+        if flags & 0x0001:
+            _, pos = __read_vint(a, pos)
+        data_size = 0
+        if flags & 0x0002:
+            data_size, pos = __read_vint(a, pos)
+        if 4 == tipe:
+            log("utils.movie_size_and_hash", "ERROR: Encrypted rar file.")
+            raise Exception("ERROR: Encrypted rar file.")
+        if 2 == tipe:
+            file_flags, pos = __read_vint(a, pos)
+            unpack_size, pos = __read_vint(a, pos)
+            if file_flags & 0x0008:
+                log("utils.movie_size_and_hash", "ERROR: Unknown unpacked size in rar file.")
+                raise Exception("ERROR: Unknown unpacked size in rar file.")
+            _, pos = __read_vint(a, pos)
+            if file_flags & 0x0002:
+                pos += 4
+            if file_flags & 0x0004:
+                pos += 4
+            compression, pos = __read_vint(a, pos)
+            if (compression >> 7) & 0x07:
+                log('utils.movie_size_and_hash', 'Bad compression method! Work only for "store".')
+                raise Exception('Bad compression method! Work only for "store".')
+            return dict(unpack_size=unpack_size, packed_size=data_size, data_offset=seek + header_end)
+        seek += header_end + data_size
+    return None
 
 
-def movie_size_and_hash(file_path):
+def is_rar_file(file_path):
     file_ext = path.splitext(file_path)[1]
-    if file_ext == ".rar" or file_ext == ".001":
-        return __movie_size_and_hash_rar(file_path)
+    return file_ext == ".rar" or file_ext == ".001"
 
-    longlong_format = "<q"  # little-endian long long
-    byte_size = struct.calcsize(longlong_format)
 
-    f = file(file_path, "rb")
-    file_size = f.seek(0, io.SEEK_END)
-    f.seek(0)
+def read_rar_index(firs_rar_file):
+    f = file(firs_rar_file, "rb")
+    try:
+        signature = bytes(f.read(len(RAR5_SIGNATURE)))
+        if signature == RAR5_SIGNATURE:
+            rar_index = __read_rar5_index(f)
+        elif signature[:4] == b"Rar!":
+            rar_index = __read_rar4_index(f)
+        else:
+            log("utils.movie_size_and_hash", "ERROR: This is not rar file (%s)." % path.basename(firs_rar_file))
+            raise Exception("ERROR: This is not rar file.")
+    except (struct.error, IndexError):
+        rar_index = None
+    finally:
+        f.close()
+
+    if not rar_index or not rar_index["packed_size"]:
+        log("utils.movie_size_and_hash", "ERROR: Not Body part in rar file.")
+        raise Exception("ERROR: Not Body part in rar file.")
+    return rar_index
+
+
+def __movie_size_and_hash_rar(firs_rar_file, rar_index=None):
+    log("utils.movie_size_and_hash", "Hashing Rar file...")
+    if rar_index is None:
+        rar_index = read_rar_index(firs_rar_file)
+    s_unpack_size = rar_index["unpack_size"]
+    s_partiize_body = rar_index["packed_size"]
+    s_partiize_body_start = rar_index["data_offset"]
+
+    # Every volume carries the same body size, the tail window is in the volume holding the last byte
+    last_volume = (s_unpack_size - 1) // s_partiize_body
+    last_rar_file = __get_last_split(firs_rar_file, last_volume) if last_volume else firs_rar_file
+    last_seek = s_unpack_size - last_volume * s_partiize_body + s_partiize_body_start - HASH_CHUNK_SIZE
+    chunks = __map_concurrently(
+        lambda args: __read_chunks(*args)[0],
+        [(firs_rar_file, [s_partiize_body_start]), (last_rar_file, [max(0, last_seek)])]
+    )
+    file_hash = s_unpack_size
+    for chunk in chunks:
+        file_hash = (file_hash + __sum_chunk(chunk)) & HASH_MASK
+    return s_unpack_size, "%016x" % file_hash
+
+
+def __open_remote(url, headers, method="GET", byte_range=None):
+    # Only streamed videos need the network stack
+    from urllib.request import Request
+    from .network import get_session
+
+    req = Request(url, headers=headers, method=method)
+    req.add_header("Accept-Encoding", "identity")
+    if byte_range:
+        req.add_header("Range", "bytes=%d-%d" % byte_range)
+    # Not pooled, a server ignoring the range must not be read past the first window
+    return get_session(keep_alive=False).open(req, timeout=REMOTE_TIMEOUT)
+
+
+def __get_remote_stat(url, headers):
+    # The validator tells a replaced file apart from one of the same size
+    try:
+        res = __open_remote(url, headers, method="HEAD")
+        try:
+            if res.headers.get("Content-Length"):
+                validator = res.headers.get("ETag") or res.headers.get("Last-Modified") or ""
+                return int(res.headers["Content-Length"]), validator
+        finally:
+            res.close()
+    except Exception as ex:
+        log("utils.movie_size_and_hash", f"HEAD Failed: {ex}.")
+
+    # Servers without HEAD support still report the full size for a one byte range
+    res = __open_remote(url, headers, byte_range=(0, 0))
+    try:
+        content_range = res.headers.get("Content-Range", "")
+        if res.status != 206 or not content_range.rpartition("/")[2].isdigit():
+            raise Exception("Range requests not supported.")
+        validator = res.headers.get("ETag") or res.headers.get("Last-Modified") or ""
+        return int(content_range.rpartition("/")[2]), validator
+    finally:
+        res.close()
+
+
+def get_remote_stat(file_url):
+    return __get_remote_stat(*split_url_headers(file_url))
+
+
+def __read_remote_chunk(url, headers, offset):
+    res = __open_remote(url, headers, byte_range=(offset, offset + HASH_CHUNK_SIZE - 1))
+    try:
+        if res.status != 206:
+            raise Exception("Range requests not supported.")
+        return res.read(HASH_CHUNK_SIZE)
+    finally:
+        res.close()
+
+
+def __movie_size_and_hash_remote(file_url, remote_stat=None):
+    log("utils.movie_size_and_hash", "Hashing remote file...")
+    url, headers = split_url_headers(file_url)
+    file_size = (remote_stat or __get_remote_stat(url, headers))[0]
+    if file_size < HASH_CHUNK_SIZE * 2:
+        log("utils.movie_size_and_hash", "ERROR: SizeError (%d)." % file_size)
+        raise Exception("SizeError")
+
     movie_hash = file_size
+    for chunk in __map_concurrently(lambda offset: __read_remote_chunk(url, headers, offset),
+                                    [0, file_size - HASH_CHUNK_SIZE]):
+        movie_hash = (movie_hash + __sum_chunk(chunk)) & HASH_MASK
 
-    if file_size < 65536 * 2:
-        f.close()
+    return file_size, "%016x" % movie_hash
+
+
+def movie_size_and_hash(file_path, rar_index=None, remote_stat=None):
+    if is_remote_path(file_path):
+        return __movie_size_and_hash_remote(file_path, remote_stat=remote_stat)
+    if is_rar_file(file_path):
+        return __movie_size_and_hash_rar(file_path, rar_index=rar_index)
+
+    file_size = __get_file_size(file_path)
+    if file_size < HASH_CHUNK_SIZE * 2:
         log("utils.movie_size_and_hash", "ERROR: SizeError (%d)." % file_size)
         raise Exception("SizeError")
 
-    for x in range(65536 // byte_size):
-        buff = f.read(byte_size)
-        (l_value,) = struct.unpack(longlong_format, buff)
-        movie_hash += l_value
-        movie_hash &= 0xFFFFFFFFFFFFFFFF  # to remain as 64bit number
-
-    f.seek(max(0, file_size - 65536), 0)
-    for x in range(65536 // byte_size):
-        buff = f.read(byte_size)
-        (l_value,) = struct.unpack(longlong_format, buff)
-        movie_hash += l_value
-        movie_hash &= 0xFFFFFFFFFFFFFFFF
-    returned_movie_hash = "%016x" % movie_hash
-    f.close()
-
-    return file_size, returned_movie_hash
+    movie_hash = file_size
+    for chunk in __read_chunks(file_path, [0, file_size - HASH_CHUNK_SIZE]):
+        movie_hash = (movie_hash + __sum_chunk(chunk)) & HASH_MASK
+
+    return file_size, "%016x" % movie_hash
@@ -1,18 +1,19 @@
 # -*- coding: utf-8 -*-
 
 import sys
-import shutil
 from os import path
 from urllib import parse
 
 import xbmc
 import xbmcvfs
-import xbmcgui
 import xbmcaddon
 import xbmcplugin
 
-from resources.lib.bsplayer import BSPlayer, OpenSubtitles, GetSubtitle
-from resources.lib.utils import log, notify, get_params, get_video_path, get_languages_dict
+# Everything else is imported by the action that needs it, engines load on first use
+from resources.lib.engines import ENGINE_NAMES, get_engine, get_engine_kwargs, search_parts, download_subtitle
+from resources.lib.metrics import get_metrics
+from resources.lib.ranking import SUBTITLE_FORMATS, get_release_tokens, score_subtitles, merge_subtitles
+from resources.lib.utils import log, notify, get_params, get_video_paths, get_languages_dict
 
 __addon__ = xbmcaddon.Addon()
 __author__ = __addon__.getAddonInfo("author")
@@ -24,83 +25,197 @@ __language__ = __addon__.getLocalizedString
 __cwd__ = xbmcvfs.translatePath(__addon__.getAddonInfo("path"))
 __profile__ = xbmcvfs.translatePath(__addon__.getAddonInfo("profile"))
 __resource__ = xbmcvfs.translatePath(path.join(__cwd__, "resources", "lib"))
-__temp__ = xbmcvfs.translatePath(path.join(__profile__, "temp", ""))
 
-engines = {
-    "BSPlayer": BSPlayer,
-    "OpenSubtitles": OpenSubtitles,
-    "GetSubtitle": GetSubtitle
-}
+found_subtitles = []
+scored_results = {}
+
+
+def search_engine(engine_name, video_paths, language_ids):
+    from resources.lib.retry import Deadline
+
+    deadline = Deadline(__addon__.getSettingInt("engine_timeout"))
+    with get_metrics().span("engine", engine=engine_name):
+        return search_parts(engine_name, video_paths, language_ids, deadline=deadline)
+
+
+def get_list_items(ranked, part=None):
+    import xbmcgui
+
+    list_items = []
+    for engine_name, subtitle, score in ranked:
+        list_item = xbmcgui.ListItem(
+            label=engine_name if part is None else f"{engine_name} CD{part}",
+            label2=subtitle["subName"],
+        )
+        list_item.setArt({
+            "icon": f"{float(subtitle['subRating']) / 2}",
+            "thumb": xbmc.convertLanguage(subtitle["subLang"], xbmc.ISO_639_1)
+        })
+
+        query = parse.urlencode(dict(
+            action="download",
+            engine=engine_name,
+            link=subtitle["subDownloadLink"],
+            file_name=subtitle["subName"],
+            format=subtitle["subFormat"]
+        ))
+        plugin_url = f"plugin://{__scriptid__}/?{query}"
+        log("Service.plugin_url", lambda: f"Plugin Url Created: {plugin_url}.")
+        list_items.append((plugin_url, list_item, False))
+    return list_items
+
+
+def add_subtitles(engine_name, parts):
+    log("Service.subtitles", lambda: f"{engine_name} Subtitles found: {parts}.")
+    # Scored while the other engines are still searching, only the merge waits for the last one
+    with get_metrics().span("score", engine=engine_name):
+        scored_results[engine_name] = [
+            score_subtitles([(engine_name, subtitle) for subtitle in part], get_release_tokens(video_path))
+            for part, video_path in zip(parts, video_paths)
+        ]
+
+
+def list_subtitles(video_paths, language_ids):
+    list_items = []
+    for i in range(len(video_paths)):
+        # Engines are merged in their listing order, which breaks ties between equally ranked subtitles
+        scored = [
+            entry for engine_name in ENGINE_NAMES if engine_name in scored_results
+            for entry in scored_results[engine_name][i]
+        ]
+        with get_metrics().span("rank"):
+            ranked = merge_subtitles(scored, language_ids)
+        log("Service.subtitles", f"{len(ranked)} Of {len(scored)} Subtitles Listed After Merging Duplicates.")
+        found_subtitles.extend((engine_name, subtitle) for engine_name, subtitle, score in ranked)
+        # Parts of a stack are listed in order, each one labeled with its number
+        list_items.extend(get_list_items(ranked, part=i + 1 if len(video_paths) > 1 else None))
+    with get_metrics().span("render"):
+        xbmcplugin.addDirectoryItems(handle=int(sys.argv[1]), items=list_items)
+
+
+def prefetch_subtitles(language_ids, count):
+    from resources.lib.cache import get_subtitle_store
+
+    selected = []
+    for language_id in language_ids:
+        candidates = [
+            (engine_name, subtitle) for engine_name, subtitle in found_subtitles
+            if subtitle["subLang"] == language_id and subtitle["subFormat"] in SUBTITLE_FORMATS
+        ]
+        # Subtitles are found in ranked order, the best ones are fetched
+        selected.extend(candidates[:count])
+
+    subtitle_store = get_subtitle_store()
+    downloads = {}
+    for engine_name, subtitle in selected:
+        if not subtitle_store.lookup(engine_name, subtitle["subDownloadLink"]):
+            dest_path = subtitle_store.get_path(engine_name, subtitle["subDownloadLink"], subtitle["subName"])
+            downloads.setdefault(engine_name, []).append((subtitle["subDownloadLink"], dest_path))
+
+    log("Service.prefetch", f"Prefetching {sum(map(len, downloads.values()))} Subtitles.")
+    for engine_name, engine_downloads in downloads.items():
+        try:
+            engine = get_engine(engine_name)(**get_engine_kwargs(engine_name))
+            results = engine.download_subtitles_batch(engine_downloads)
+        except Exception as ex:
+            log("Service.prefetch", f"{engine_name} Error: {ex}.")
+            results = {}
+        for download_link, dest_path in engine_downloads:
+            if results.get(download_link):
+                subtitle_store.add(engine_name, download_link, dest_path)
+            else:
+                subtitle_store.discard(engine_name, download_link)
+
+
 params = get_params()
 log(f"Service.params", f"Current Action: {params['action']}.")
 if params["action"] == "search":
-    video_path = get_video_path()
-    if video_path.startswith("http://") or video_path.startswith("https://"):
-        notify(__scriptname__, __language__, 32001)
-        log("Service.get_video_path", "Streaming not supported.")
+    from concurrent import futures
+    from resources.lib.retry import get_circuit_breaker
+    from resources.lib.scheduling import get_engine_scheduler
 
-    log("Service.video_path", f"Current Video Path: {video_path}.")
+    video_paths = get_video_paths()
+    log("Service.video_path", f"Current Video Paths: {video_paths}.")
     languages = get_languages_dict(params["languages"])
     log("Service.languages", f"Current Languages: {languages}.")
 
-    for engine_name, engine in engines.items():
-        kwargs = {}
-        if engine_name == "OpenSubtitles":
-            username = __addon__.getSetting("OSuser")
-            password = __addon__.getSetting("OSpass")
-            kwargs.update({"username": username, "password": password})
-            if not all([username, password]):
-                notify(__scriptname__, __language__, 32005)
-                log("Service.subtitles", "OpenSubtitles username or password is empty.")
-                continue
+    engine_names = []
+    for engine_name in ENGINE_NAMES:
+        if engine_name == "OpenSubtitles" and not all(get_engine_kwargs(engine_name).values()):
+            notify(__scriptname__, __language__, 32005)
+            log("Service.subtitles", "OpenSubtitles username or password is empty.")
+            continue
+        if not get_circuit_breaker().allow(engine_name):
+            log("Service.subtitles", f"{engine_name} Keeps Failing, Skipped Until Its Cool-Down Expires.")
+            continue
+        engine_names.append(engine_name)
+
+    engine_scheduler = get_engine_scheduler()
+    if engine_scheduler is not None:
+        # Engines that rarely find these languages are skipped, the rest are searched in order of usefulness
+        engine_names = engine_scheduler.schedule(engine_names, list(languages.keys()))
+        log("Service.subtitles", f"Scheduled Engines: {', '.join(engine_names)}.")
 
+    if __addon__.getSettingBool("prewarm"):
+        from resources.lib.prewarm import get_prewarmed
+
+        # Engines already searched by the prewarm service when playback started are answered from memory
+        with get_metrics().span("prewarmed"):
+            prewarmed = get_prewarmed(
+                video_paths, list(languages.keys()), wait=__addon__.getSettingInt("engine_timeout")
+            )
+        for engine_name, subtitles in prewarmed.items():
+            if engine_name in engine_names:
+                log("Service.search", f"{engine_name} Results Prewarmed.")
+                add_subtitles(engine_name, subtitles)
+        engine_names = [engine_name for engine_name in engine_names if engine_name not in prewarmed]
+
+    if __addon__.getSettingBool("concurrent_search"):
+        engine_timeout = __addon__.getSettingInt("engine_timeout")
+        executor = futures.ThreadPoolExecutor(max_workers=len(engine_names) or 1)
+        pending = {
+            executor.submit(search_engine, engine_name, video_paths, list(languages.keys())): engine_name
+            for engine_name in engine_names
+        }
         try:
-            with engine(**kwargs) as sub:
-                subtitles = sub.search_subtitles(video_path, language_ids=list(languages.keys()))
-                log("Service.subtitles", f"Subtitles found: {subtitles}.")
-                for subtitle in sorted(subtitles, key=lambda s: s["subLang"]):
-                    list_item = xbmcgui.ListItem(
-                        label=engine_name,
-                        label2=subtitle["subName"],
-                    )
-                    list_item.setArt({
-                        "icon": f"{float(subtitle['subRating']) / 2}",
-                        "thumb": xbmc.convertLanguage(subtitle["subLang"], xbmc.ISO_639_1)
-                    })
-
-                    query = parse.urlencode(dict(
-                        action="download",
-                        engine=engine_name,
-                        link=subtitle["subDownloadLink"],
-                        file_name=subtitle["subName"],
-                        format=subtitle["subFormat"]
-                    ))
-                    plugin_url = f"plugin://{__scriptid__}/?{query}"
-                    log("Service.plugin_url", f"Plugin Url Created: {plugin_url}.")
-                    xbmcplugin.addDirectoryItem(
-                        handle=int(sys.argv[1]),
-                        url=plugin_url, listitem=list_item,
-                        isFolder=False
-                    )
-        except Exception as ex:
-            log("Service.search", f"{engine_name} Error: {ex}.")
+            for future in futures.as_completed(pending, timeout=engine_timeout or None):
+                engine_name = pending.pop(future)
+                try:
+                    add_subtitles(engine_name, future.result())
+                except Exception as ex:
+                    log("Service.search", f"{engine_name} Error: {ex}.")
+        except futures.TimeoutError:
+            log("Service.search", f"Timeout ({engine_timeout}s) Exceeded By: {', '.join(pending.values())}.")
+        # Do not wait for engines that exceeded their time budget
+        executor.shutdown(wait=False)
+    else:
+        for engine_name in engine_names:
+            try:
+                add_subtitles(engine_name, search_engine(engine_name, video_paths, list(languages.keys())))
+            except Exception as ex:
+                log("Service.search", f"{engine_name} Error: {ex}.")
+
+    list_subtitles(video_paths, list(languages.keys()))
 
 elif params["action"] == "manualsearch":
     notify(__scriptname__, __language__, 32002)
     log("Service.manualsearch", "Manual search not supported.")
 
 elif params["action"] == "download":
-    if xbmcvfs.exists(__temp__):
-        shutil.rmtree(__temp__)
-    xbmcvfs.mkdirs(__temp__)
-
-    if params["format"] in ["srt", "sub", "txt", "smi", "ssa", "ass"]:
-        subtitle_path = path.join(__temp__, params["file_name"])
-        engine = engines[params["engine"]]()
-        if engine.download_subtitles(download_url=params["link"], dest_path=subtitle_path):
-            log("Service.download_subtitles", f"Subtitles Download Successfully From: {params['link']}")
+    if params["format"] in SUBTITLE_FORMATS:
+        subtitle_path = download_subtitle(params["engine"], params["link"], params["file_name"])
+        if subtitle_path:
+            import xbmcgui
+
             list_item = xbmcgui.ListItem(label=subtitle_path)
             log("Service.download", f"Downloaded Subtitle Path: {subtitle_path}")
             xbmcplugin.addDirectoryItem(handle=int(sys.argv[1]), url=subtitle_path, listitem=list_item, isFolder=False)
 
 xbmcplugin.endOfDirectory(int(sys.argv[1]))
+
+if params["action"] == "search" and __addon__.getSettingBool("prefetch"):
+    # The dialog is already listed, the download action finds these in the subtitle store
+    with get_metrics().span("prefetch"):
+        prefetch_subtitles(list(languages.keys()), __addon__.getSettingInt("prefetch_count"))
+
+get_metrics().dump(params["action"])
@@ -0,0 +1,112 @@
+import io
+import os
+import time
+import zlib
+import base64
+import tempfile
+from urllib.parse import urlparse
+from email.message import Message
+from urllib.response import addinfourl
+
+os.environ.setdefault("BSPLAYER_PROFILE", tempfile.mkdtemp(prefix="bsplayer-test-"))
+
+from benchmarks import fixtures
+from resources.lib import bsplayer
+from resources.lib.bsplayer import BSPlayer, GetSubtitle
+from resources.lib.mirrors import get_hedge_policy
+
+DOWNLOAD_URL = "http://api.getsubtitle.com/?cod_subtitle_file={}&movie_hash=0123456789abcdef"
+
+
+class FixtureSession(object):
+    def __init__(self, body):
+        self.body = body
+
+    def open(self, req, timeout=None):
+        headers = Message()
+        headers["Content-Length"] = str(len(self.body))
+        return addinfourl(io.BytesIO(self.body), headers, req.full_url, 200)
+
+
+def download_batch(tmp_path, response, cods):
+    engine = GetSubtitle()
+    engine.session = FixtureSession(response)
+    downloads = [(DOWNLOAD_URL.format(cod), str(tmp_path / f"{cod}.srt")) for cod in cods]
+    return engine.download_subtitles_batch(downloads), downloads
+
+
+def test_subtitle_left_out_of_a_named_response_fails(tmp_path):
+    response = fixtures.getsubtitle_download_response([222], data=b"B")
+    results, downloads = download_batch(tmp_path, response, [111, 222])
+
+    assert results == {downloads[0][0]: False, downloads[1][0]: True}
+    assert not os.path.exists(downloads[0][1])
+    with open(downloads[1][1], "rb") as f:
+        assert f.read() == b"B"
+
+
+def test_unnamed_items_are_matched_by_position(tmp_path):
+    item = fixtures.soap_item(data=base64.b64encode(zlib.compress(b"B")).decode())
+    response = fixtures.soap_response("downloadSubtitles", f"<return>{item}</return>", namespace="downloadSubtitles_wsdl")
+    results, downloads = download_batch(tmp_path, response, [111, 222])
+
+    assert results == {downloads[0][0]: True, downloads[1][0]: False}
+    with open(downloads[0][1], "rb") as f:
+        assert f.read() == b"B"
+
+
+class MirrorSession(object):
+    # Every mirror only accepts the handle it issued, the primary one answers late
+    def __init__(self, slow_host, delay):
+        self.slow_host = slow_host
+        self.delay = delay
+        self.searches = []
+
+    def open(self, req, timeout=None):
+        host = urlparse(req.full_url).hostname
+        func_name = req.get_header("Soapaction").strip('"').split("#")[-1]
+        token = f"token-{host}"
+        if func_name == "logIn":
+            body = fixtures.bsplayer_login_response(token)
+        elif f"<handle>{token}</handle>".encode() not in req.data:
+            body = fixtures.bsplayer_status_response(func_name, "HANDLE_INVALID")
+        else:
+            self.searches.append(host)
+            if host == self.slow_host:
+                time.sleep(self.delay)
+            body = fixtures.bsplayer_search_response(3)
+        return FixtureSession(body).open(req)
+
+
+def test_hedge_searches_with_a_handle_of_its_own_mirror(monkeypatch):
+    monkeypatch.setattr(bsplayer, "get_setting", lambda setting_id, default="": (
+        True if setting_id == "hedge_requests" else default
+    ))
+    hedge_policy = get_hedge_policy()
+    hedge_policy.set("latencies", [0.01] * hedge_policy.min_samples)
+    hedge_policy.set("requests", 1000)
+
+    engine = BSPlayer(search_url="http://s1.api.bsplayer-subtitles.com/v1.php")
+    engine.session = MirrorSession("s1.api.bsplayer-subtitles.com", delay=1.0)
+    engine.token = "token-s1.api.bsplayer-subtitles.com"
+    start = time.time()
+    subtitles = engine.search_subtitles_by_hash(4 << 30, "0123456789abcdef", "eng")
+
+    # The hedge answered first, with results, long before the primary mirror
+    assert len(subtitles) == 3
+    assert time.time() - start < 0.9
+    assert len(set(engine.session.searches)) == 2
+
+
+def test_only_searches_that_reached_the_provider_report_a_latency():
+    engine = BSPlayer(search_url="http://s1.api.bsplayer-subtitles.com/v1.php")
+    engine.session = MirrorSession("s1.api.bsplayer-subtitles.com", delay=0.05)
+    engine.token = "token-s1.api.bsplayer-subtitles.com"
+    latencies = []
+    first = engine.search_subtitles_cached(5 << 30, "fedcba9876543210", "eng", latencies=latencies)
+    second = engine.search_subtitles_cached(5 << 30, "fedcba9876543210", "eng", latencies=latencies)
+
+    # The second search is a result cache hit, it must not count as a sample of the provider
+    assert first == second and len(first) == 3
+    assert len(latencies) == 1 and latencies[0] >= 0.05
+    assert engine.session.searches == ["s1.api.bsplayer-subtitles.com"]
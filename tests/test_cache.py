@@ -0,0 +1,91 @@
+import os
+import tempfile
+import threading
+from concurrent import futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+os.environ.setdefault("BSPLAYER_PROFILE", tempfile.mkdtemp(prefix="bsplayer-test-"))
+
+from resources.lib import utils
+from resources.lib.cache import HashCache
+
+MEDIA = bytes(range(256)) * 1024
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    requests = []
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_media(self, body):
+        with self.lock:
+            self.requests.append((self.command, self.headers.get("Range")))
+        byte_range = self.headers.get("Range")
+        if byte_range:
+            start, end = map(int, byte_range.partition("=")[2].split("-"))
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(MEDIA)}")
+            data = MEDIA[start:end + 1]
+        else:
+            self.send_response(200)
+            data = MEDIA
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+        if body:
+            self.wfile.write(data)
+
+    def do_HEAD(self):
+        self.send_media(False)
+
+    def do_GET(self):
+        self.send_media(True)
+
+
+def serve():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_remote_hash_is_shared_by_concurrent_engines(tmp_path):
+    media_path = tmp_path / "movie.mkv"
+    media_path.write_bytes(MEDIA)
+    RangeHandler.requests = []
+    server = serve()
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/movie.mkv|User-Agent=Kodi"
+        hash_cache = HashCache()
+        with futures.ThreadPoolExecutor(max_workers=3) as executor:
+            results = list(executor.map(hash_cache.movie_size_and_hash, [url] * 3))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert results == [utils.movie_size_and_hash(str(media_path))] * 3
+    # One HEAD and the two windows, however many engines ask
+    assert sorted(RangeHandler.requests, key=str) == sorted([
+        ("HEAD", None),
+        ("GET", f"bytes=0-{utils.HASH_CHUNK_SIZE - 1}"),
+        ("GET", f"bytes={len(MEDIA) - utils.HASH_CHUNK_SIZE}-{len(MEDIA) - 1}"),
+    ], key=str)
+
+
+def test_remote_hash_is_reused_by_the_next_run_while_unchanged():
+    RangeHandler.requests = []
+    server = serve()
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/movie.mkv"
+        hash_cache = HashCache()
+        first = hash_cache.movie_size_and_hash(url)
+        hash_cache.reset_remote()
+        second = hash_cache.movie_size_and_hash(url)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert first == second
+    # The second run only checks the size and the validator
+    assert [command for command, _ in RangeHandler.requests] == ["HEAD", "GET", "GET", "HEAD"]
@@ -0,0 +1,57 @@
+import os
+import json
+import tempfile
+
+os.environ.setdefault("BSPLAYER_PROFILE", tempfile.mkdtemp(prefix="bsplayer-test-"))
+
+from resources.lib.storage import JSONStore
+from resources.lib.metrics import Metrics
+
+
+def open_store(store, tmp_path, name="store.json"):
+    store.file_path = str(tmp_path / name)
+    return store
+
+
+def read_store(tmp_path, name="store.json"):
+    with open(tmp_path / name, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_metrics_of_other_processes_survive_a_long_running_dump(tmp_path):
+    service = open_store(Metrics(), tmp_path)
+    plugin = open_store(Metrics(), tmp_path)
+
+    service.dump("prewarm")
+    plugin.dump("search")
+    service.reset()
+    service.dump("prewarm")
+
+    assert sorted(entry["action"] for entry in read_store(tmp_path).values()) == ["prewarm", "prewarm", "search"]
+
+
+def test_save_merges_sets_and_pops_over_the_file(tmp_path):
+    first = open_store(JSONStore("store.json"), tmp_path)
+    second = open_store(JSONStore("store.json"), tmp_path)
+
+    first.set("a", 1)
+    first.set("b", 2)
+    # Loaded before the other process pops "a" and sets "c"
+    assert second.get("a") == 1
+    first.pop("a")
+    first.set("c", 3)
+    second.set("d", 4)
+
+    assert read_store(tmp_path) == dict(b=2, c=3, d=4)
+    assert second.get("c") == 3 and second.get("a") is None
+
+
+def test_max_entries_drop_the_oldest_entries_of_all_processes(tmp_path):
+    first = open_store(JSONStore("store.json", max_entries=2), tmp_path)
+    second = open_store(JSONStore("store.json", max_entries=2), tmp_path)
+
+    first.set("a", 1)
+    second.set("b", 2)
+    first.set("c", 3)
+
+    assert list(read_store(tmp_path)) == ["b", "c"]
@@ -0,0 +1,33 @@
+import os
+import glob
+
+import pytest
+
+from benchmarks import fixtures
+from resources.lib import utils
+
+VOLUME_SIZE = 200000
+
+
+def create_release(directory, unpack_size, rar5):
+    first_volume = fixtures.create_rar_release(str(directory), "movie", unpack_size, VOLUME_SIZE, rar5=rar5)
+    data_offset = utils.read_rar_index(first_volume)["data_offset"]
+    unpacked_path = os.path.join(str(directory), "movie.mkv")
+    with open(unpacked_path, "wb") as unpacked:
+        for volume_path in sorted(glob.glob(os.path.join(str(directory), "movie.part*.rar"))):
+            with open(volume_path, "r+b") as f:
+                # The fixture leaves the end of every body empty, the tail window must not hash as zeros
+                f.seek(-utils.HASH_CHUNK_SIZE, os.SEEK_END)
+                f.write(os.urandom(utils.HASH_CHUNK_SIZE))
+                f.seek(data_offset)
+                unpacked.write(f.read())
+    return first_volume, unpacked_path
+
+
+@pytest.mark.parametrize("rar5", [False, True], ids=["rar4", "rar5"])
+@pytest.mark.parametrize("unpack_size", [3 * VOLUME_SIZE, 3 * VOLUME_SIZE + 70000])
+def test_rar_hash_matches_the_unpacked_file(tmp_path, rar5, unpack_size):
+    # 3 * VOLUME_SIZE ends exactly on a volume boundary, the tail window is the end of the last volume body
+    first_volume, unpacked_path = create_release(tmp_path, unpack_size, rar5)
+    assert os.path.getsize(unpacked_path) == unpack_size
+    assert utils.movie_size_and_hash(first_volume) == utils.movie_size_and_hash(unpacked_path)